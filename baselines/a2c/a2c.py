@@ -12,6 +12,7 @@ from baselines.common import set_global_seeds, explained_variance
 from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
 from baselines.common.atari_wrappers import wrap_deepmind
 from baselines.common import tf_util
+from baselines.common.rollout_storage import RolloutStorage
 
 from baselines.a2c.utils import discount_with_dones
 from baselines.a2c.utils import Scheduler, make_path, find_trainable_variables
@@ -102,16 +103,17 @@ class Runner(object):
         self.nsteps = nsteps
         self.states = model.initial_state
         self.dones = [False for _ in range(nenv)]
+        # written in place every rollout, the returned batches are views of it;
+        # dones has one more entry, for the dones after the last step
+        self.storage = RolloutStorage(nenv, nsteps, dtypes={'obs': np.uint8, 'rewards': np.float32,
+            'actions': np.int32, 'values': np.float32, 'dones': np.bool_}, lengths={'dones': nsteps + 1})
 
     def run(self):
-        mb_obs, mb_rewards, mb_actions, mb_values, mb_dones = [],[],[],[],[]
+        storage = self.storage
         mb_states = self.states
-        for n in range(self.nsteps):
+        for t in range(self.nsteps):
             actions, values, states, _ = self.model.step(self.obs, self.states, self.dones)
-            mb_obs.append(np.copy(self.obs))
-            mb_actions.append(actions)
-            mb_values.append(values)
-            mb_dones.append(self.dones)
+            storage.store(t, obs=self.obs, actions=actions, values=values, dones=self.dones)
             obs, rewards, dones, _ = self.env.step(actions)
             self.states = states
             self.dones = dones
@@ -119,30 +121,19 @@ class Runner(object):
                 if done:
                     self.obs[n] = self.obs[n]*0
             self.obs = obs
-            mb_rewards.append(rewards)
-        mb_dones.append(self.dones)
-        #batch of steps to batch of rollouts
-        mb_obs = np.asarray(mb_obs, dtype=np.uint8).swapaxes(1, 0).reshape(self.batch_ob_shape)
-        mb_rewards = np.asarray(mb_rewards, dtype=np.float32).swapaxes(1, 0)
-        mb_actions = np.asarray(mb_actions, dtype=np.int32).swapaxes(1, 0)
-        mb_values = np.asarray(mb_values, dtype=np.float32).swapaxes(1, 0)
-        mb_dones = np.asarray(mb_dones, dtype=np.bool).swapaxes(1, 0)
-        mb_masks = mb_dones[:, :-1]
-        mb_dones = mb_dones[:, 1:]
-        last_values = self.model.value(self.obs, self.states, self.dones).tolist()
-        #discount/bootstrap off value fn
-        for n, (rewards, dones, value) in enumerate(zip(mb_rewards, mb_dones, last_values)):
-            rewards = rewards.tolist()
-            dones = dones.tolist()
-            if dones[-1] == 0:
-                rewards = discount_with_dones(rewards+[value], dones+[0], self.gamma)[:-1]
-            else:
-                rewards = discount_with_dones(rewards, dones, self.gamma)
-            mb_rewards[n] = rewards
-        mb_rewards = mb_rewards.flatten()
-        mb_actions = mb_actions.flatten()
-        mb_values = mb_values.flatten()
-        mb_masks = mb_masks.flatten()
+            storage.store(t, rewards=rewards)
+        storage.store(self.nsteps, dones=self.dones)
+        #batch of rollouts, ordered by env
+        mb_obs = storage.flat('obs')
+        mb_masks = storage['dones'][:, :-1]
+        mb_dones = storage['dones'][:, 1:]
+        last_values = self.model.value(self.obs, self.states, self.dones)
+        #discount/bootstrap off value fn, for all envs at once
+        mb_rewards = discount_with_dones(storage['rewards'], mb_dones, self.gamma, last_values)
+        mb_rewards = mb_rewards.reshape(-1)
+        mb_actions = storage.flat('actions')
+        mb_values = storage.flat('values')
+        mb_masks = mb_masks.reshape(-1)
         return mb_obs, mb_states, mb_rewards, mb_masks, mb_actions, mb_values
 
 def learn(policy, env, seed, nsteps=5, total_timesteps=int(80e6), vf_coef=0.5, ent_coef=0.01, max_grad_norm=0.5, lr=7e-4, lrschedule='linear', epsilon=1e-5, alpha=0.99, gamma=0.99, log_interval=100):
@@ -4,6 +4,7 @@ import numpy as np
 import tensorflow as tf
 from gym import spaces
 from collections import deque
+from baselines.common.math_util import discount_with_boundaries
 
 def sample(logits):
     noise = tf.random_uniform(tf.shape(logits))
@@ -149,13 +150,23 @@ def conv_to_fc(x):
     x = tf.reshape(x, [-1, nh])
     return x
 
-def discount_with_dones(rewards, dones, gamma):
-    discounted = []
-    r = 0
-    for reward, done in zip(rewards[::-1], dones[::-1]):
-        r = reward + gamma*r*(1.-done) # fixed off by one bug
-        discounted.append(r)
-    return discounted[::-1]
+def discount_with_dones(rewards, dones, gamma, last_values=None):
+    """
+    Discounted returns of rewards and dones of shape [nsteps] or [nenvs, nsteps]
+    (time along the last axis), where dones[t] ends the episode after step t:
+    R[t] = rewards[t] + gamma*R[t+1]*(1-dones[t]), with R[nsteps] = last_values
+    (the bootstrap values of shape [] or [nenvs]) or 0 if not given.
+    """
+    rewards = np.asarray(rewards, dtype=np.float32)
+    dones = np.asarray(dones, dtype=np.float32)
+    if last_values is not None:
+        # bootstrap as the reward of an extra step that never ends
+        rewards = np.concatenate([rewards, np.asarray(last_values, dtype=np.float32)[..., None]], axis=-1)
+        dones = np.concatenate([dones, np.zeros_like(dones[..., :1])], axis=-1)
+    # time-major; an episode boundary before step t+1 is a done at step t
+    starts = np.concatenate([np.zeros_like(dones[..., :1]), dones[..., :-1]], axis=-1)
+    discounted = discount_with_boundaries(rewards.T, starts.T, gamma).T
+    return discounted[..., :-1] if last_values is not None else discounted
 
 def find_trainable_variables(key):
     with tf.variable_scope(key):
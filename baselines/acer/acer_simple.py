@@ -5,6 +5,8 @@ import tensorflow as tf
 from baselines import logger
 
 from baselines.common import set_global_seeds
+from baselines.common.vec_env.vec_frame_stack import FrameStackRing
+from baselines.common.rollout_storage import RolloutStorage
 
 from baselines.a2c.utils import batch_to_seq, seq_to_batch
 from baselines.a2c.utils import Scheduler, make_path, find_trainable_variables
@@ -220,46 +222,44 @@ class Runner(object):
         self.nact = env.action_space.n
         self.nbatch = nenv * nsteps
         self.batch_ob_shape = (nenv*(nsteps+1), nh, nw, nc*nstack)
-        self.obs = np.zeros((nenv, nh, nw, nc * nstack), dtype=np.uint8)
+        self.frames = FrameStackRing(nenv, (nh, nw, nc), nstack, np.uint8)
         obs = env.reset()
         self.update_obs(obs)
         self.nsteps = nsteps
         self.states = model.initial_state
         self.dones = [False for _ in range(nenv)]
+        # written in place every rollout, the returned arrays are views of it;
+        # obs and dones also hold the step after the last one, enc_obs the
+        # nstack frames of the first observation followed by one per step
+        self.storage = RolloutStorage(nenv, nsteps, dtypes={'enc_obs': np.uint8, 'obs': np.uint8,
+            'actions': np.int32, 'rewards': np.float32, 'mus': np.float32, 'dones': np.bool_},
+            lengths={'enc_obs': nsteps + nstack, 'obs': nsteps + 1, 'dones': nsteps + 1})
 
     def update_obs(self, obs, dones=None):
-        if dones is not None:
-            self.obs *= (1 - dones.astype(np.uint8))[:, None, None, None]
-        self.obs = np.roll(self.obs, shift=-self.nc, axis=3)
-        self.obs[:, :, :, -self.nc:] = obs[:, :, :, :]
+        # self.obs is a view into the frame ring, valid until the next update
+        self.frames.push(obs, dones)
+        self.obs = self.frames.view()
 
     def run(self):
-        enc_obs = np.split(self.obs, self.nstack, axis=3)  # so now list of obs steps
-        mb_obs, mb_actions, mb_mus, mb_dones, mb_rewards = [], [], [], [], []
-        for _ in range(self.nsteps):
+        storage, nc = self.storage, self.nc
+        for i in range(self.nstack):
+            storage.store(i, enc_obs=self.obs[..., i * nc:(i + 1) * nc])
+        for t in range(self.nsteps):
             actions, mus, states = self.model.step(self.obs, state=self.states, mask=self.dones)
-            mb_obs.append(np.copy(self.obs))
-            mb_actions.append(actions)
-            mb_mus.append(mus)
-            mb_dones.append(self.dones)
+            storage.store(t, obs=self.obs, actions=actions, mus=mus, dones=self.dones)
             obs, rewards, dones, _ = self.env.step(actions)
             # states information for statefull models like LSTM
             self.states = states
             self.dones = dones
             self.update_obs(obs, dones)
-            mb_rewards.append(rewards)
-            enc_obs.append(obs)
-        mb_obs.append(np.copy(self.obs))
-        mb_dones.append(self.dones)
+            storage.store(t, rewards=rewards)
+            storage.store(self.nstack + t, enc_obs=obs)
+        storage.store(self.nsteps, obs=self.obs, dones=self.dones)
 
-        enc_obs = np.asarray(enc_obs, dtype=np.uint8).swapaxes(1, 0)
-        mb_obs = np.asarray(mb_obs, dtype=np.uint8).swapaxes(1, 0)
-        mb_actions = np.asarray(mb_actions, dtype=np.int32).swapaxes(1, 0)
-        mb_rewards = np.asarray(mb_rewards, dtype=np.float32).swapaxes(1, 0)
-        mb_mus = np.asarray(mb_mus, dtype=np.float32).swapaxes(1, 0)
-
-        mb_dones = np.asarray(mb_dones, dtype=np.bool).swapaxes(1, 0)
+        enc_obs, mb_obs, mb_actions = storage['enc_obs'], storage['obs'], storage['actions']
+        mb_rewards, mb_mus = storage['rewards'], storage['mus']
 
+        mb_dones = storage['dones']
         mb_masks = mb_dones # Used for statefull models like LSTM's to mask state when done
         mb_dones = mb_dones[:, 1:] # Used for calculating returns. The dones array is now aligned with rewards
 
@@ -314,7 +314,7 @@ class Acer():
 
 def learn(policy, env, seed, nsteps=20, nstack=4, total_timesteps=int(80e6), q_coef=0.5, ent_coef=0.01,
           max_grad_norm=10, lr=7e-4, lrschedule='linear', rprop_epsilon=1e-5, rprop_alpha=0.99, gamma=0.99,
-          log_interval=100, buffer_size=50000, replay_ratio=4, replay_start=10000, c=10.0,
+          log_interval=100, buffer_size=50000, buffer_dir=None, replay_ratio=4, replay_start=10000, c=10.0,
           trust_region=True, alpha=0.99, delta=1):
     print("Running Acer Simple")
     print(locals())
@@ -333,7 +333,7 @@ def learn(policy, env, seed, nsteps=20, nstack=4, total_timesteps=int(80e6), q_c
 
     runner = Runner(env=env, model=model, nsteps=nsteps, nstack=nstack)
     if replay_ratio > 0:
-        buffer = Buffer(env=env, nsteps=nsteps, nstack=nstack, size=buffer_size)
+        buffer = Buffer(env=env, nsteps=nsteps, nstack=nstack, size=buffer_size, storage_dir=buffer_dir)
     else:
         buffer = None
     nbatch = nenvs*nsteps
@@ -1,14 +1,19 @@
+import os
+
 import numpy as np
 
+from baselines.common import array_storage
+
 class Buffer(object):
     # gets obs, actions, rewards, mu's, (states, masks), dones
-    def __init__(self, env, nsteps, nstack, size=50000):
+    def __init__(self, env, nsteps, nstack, size=50000, storage_dir=None):
         self.nenv = env.num_envs
         self.nsteps = nsteps
         self.nh, self.nw, self.nc = env.observation_space.shape
         self.nstack = nstack
         self.nbatch = self.nenv * self.nsteps
         self.size = size // (self.nsteps)  # Each loc contains nenv * nsteps frames, thus total buffer is nenv * size frames
+        self.storage_dir = storage_dir  # memory-map the storage from files in this directory if not None
 
         # Memory
         self.enc_obs = None
@@ -22,6 +27,9 @@ class Buffer(object):
         self.next_idx = 0
         self.num_in_buffer = 0
 
+        # Decoded observations returned by get(), reused between calls
+        self.obs = np.empty([self.nenv, self.nsteps + 1, self.nh, self.nw, self.nstack * self.nc], dtype=np.uint8)
+
     def has_atleast(self, frames):
         # Frames per env, so total (nenv * frames) Frames needed
         # Each buffer loc has nenv * nsteps frames
@@ -31,24 +39,29 @@ class Buffer(object):
         return self.num_in_buffer > 0
 
     # Generate stacked frames
-    def decode(self, enc_obs, dones):
+    def decode(self, enc_obs, dones, out=None):
         # enc_obs has shape [nenvs, nsteps + nstack, nh, nw, nc]
-        # dones has shape [nenvs, nsteps, nh, nw, nc]
-        # returns stacked obs of shape [nenv, (nsteps + 1), nh, nw, nstack*nc]
+        # dones has shape [nenvs, nsteps]
+        # returns stacked obs of shape [nenv, (nsteps + 1), nh, nw, nstack*nc], written into out if given
         nstack, nenv, nsteps, nh, nw, nc = self.nstack, self.nenv, self.nsteps, self.nh, self.nw, self.nc
-        y = np.empty([nsteps + nstack - 1, nenv, 1, 1, 1], dtype=np.float32)
-        obs = np.zeros([nstack, nsteps + nstack, nenv, nh, nw, nc], dtype=np.uint8)
-        x = np.reshape(enc_obs, [nenv, nsteps + nstack, nh, nw, nc]).swapaxes(1,
-                                                                              0)  # [nsteps + nstack, nenv, nh, nw, nc]
-        y[3:] = np.reshape(1.0 - dones, [nenv, nsteps, 1, 1, 1]).swapaxes(1, 0)  # keep
-        y[:3] = 1.0
-        # y = np.reshape(1 - dones, [nenvs, nsteps, 1, 1, 1])
-        for i in range(nstack):
-            obs[-(i + 1), i:] = x
-            # obs[:,i:,:,:,-(i+1),:] = x
-            x = x[:-1] * y
-            y = y[1:]
-        return np.reshape(obs[:, 3:].transpose((2, 1, 3, 4, 0, 5)), [nenv, (nsteps + 1), nh, nw, nstack * nc])
+        if out is None:
+            out = np.empty([nenv, nsteps + 1, nh, nw, nstack * nc], dtype=np.uint8)
+        # view the stack axis separately, frame k of the stack at step t is enc_obs[:, t + k]
+        stacked = out.reshape([nenv, nsteps + 1, nh, nw, nstack, nc])
+        for k in range(nstack):
+            stacked[:, :, :, :, k] = enc_obs[:, k:k + nsteps + 1]
+
+        # A frame belongs to an earlier episode if an episode ended between it and step t.
+        # With last[t] the last step < t that was done, frame k is dropped if t - last[t] <= nstack - 1 - k.
+        steps = np.arange(nsteps)
+        last = np.maximum.accumulate(np.where(dones, steps, -nstack), axis=1)
+        last = np.concatenate([np.full([nenv, 1], -nstack), last], axis=1)  # [nenv, nsteps + 1]
+        dist = np.arange(nsteps + 1) - last
+        for k in range(nstack - 1):
+            stale = dist <= nstack - 1 - k
+            if stale.any():
+                stacked[:, :, :, :, k][stale] = 0
+        return out
 
     def put(self, enc_obs, actions, rewards, mus, dones, masks):
         # enc_obs [nenv, (nsteps + nstack), nh, nw, nc]
@@ -56,12 +69,13 @@ class Buffer(object):
         # mus [nenv, nsteps, nact]
 
         if self.enc_obs is None:
-            self.enc_obs = np.empty([self.size] + list(enc_obs.shape), dtype=np.uint8)
-            self.actions = np.empty([self.size] + list(actions.shape), dtype=np.int32)
-            self.rewards = np.empty([self.size] + list(rewards.shape), dtype=np.float32)
-            self.mus = np.empty([self.size] + list(mus.shape), dtype=np.float32)
-            self.dones = np.empty([self.size] + list(dones.shape), dtype=np.bool)
-            self.masks = np.empty([self.size] + list(masks.shape), dtype=np.bool)
+            zeros = lambda x, dtype, name: array_storage.zeros([self.size] + list(x.shape), dtype, self.storage_dir, name)
+            self.enc_obs = zeros(enc_obs, np.uint8, 'enc_obs')
+            self.actions = zeros(actions, np.int32, 'actions')
+            self.rewards = zeros(rewards, np.float32, 'rewards')
+            self.mus = zeros(mus, np.float32, 'mus')
+            self.dones = zeros(dones, np.bool_, 'dones')
+            self.masks = zeros(masks, np.bool_, 'masks')
 
         self.enc_obs[self.next_idx] = enc_obs
         self.actions[self.next_idx] = actions
@@ -73,16 +87,36 @@ class Buffer(object):
         self.next_idx = (self.next_idx + 1) % self.size
         self.num_in_buffer = min(self.size, self.num_in_buffer + 1)
 
+    # Snapshots
+    names = ['enc_obs', 'actions', 'rewards', 'mus', 'dones', 'masks']
+
+    def save(self, path):
+        # writes the filled locs to the directory path, one .npy file per array, in chunks
+        os.makedirs(path, exist_ok=True)
+        if self.enc_obs is not None:
+            for name in self.names:
+                array_storage.save(os.path.join(path, name + '.npy'), getattr(self, name)[:self.num_in_buffer])
+        array_storage.save_state(os.path.join(path, 'state.pkl'),
+                                 {'next_idx': self.next_idx, 'num_in_buffer': self.num_in_buffer})
+
+    def load(self, path):
+        # restores a snapshot written by save, memory-mapped if it fills the buffer
+        state = array_storage.load_state(os.path.join(path, 'state.pkl'))
+        if state['num_in_buffer'] > 0:
+            for name in self.names:
+                setattr(self, name, array_storage.load(os.path.join(path, name + '.npy'), self.size,
+                                                       self.storage_dir, name))
+        self.next_idx = state['next_idx']
+        self.num_in_buffer = state['num_in_buffer']
+
     def take(self, x, idx, envx):
-        nenv = self.nenv
-        out = np.empty([nenv] + list(x.shape[2:]), dtype=x.dtype)
-        for i in range(nenv):
-            out[i] = x[idx[i], envx[i]]
-        return out
+        # gathers x[idx[i], envx[i]] for every i through linear indices into the (loc, env) axis
+        flat = x.reshape([-1] + list(x.shape[2:]))
+        return array_storage.take(flat, idx * x.shape[1] + envx)
 
     def get(self):
         # returns
-        # obs [nenv, (nsteps + 1), nh, nw, nstack*nc]
+        # obs [nenv, (nsteps + 1), nh, nw, nstack*nc], only valid until the next call
         # actions, rewards, dones [nenv, nsteps]
         # mus [nenv, nsteps, nact]
         nenv = self.nenv
@@ -95,7 +129,7 @@ class Buffer(object):
         take = lambda x: self.take(x, idx, envx)  # for i in range(nenv)], axis = 0)
         dones = take(self.dones)
         enc_obs = take(self.enc_obs)
-        obs = self.decode(enc_obs, dones)
+        obs = self.decode(enc_obs, dones, out=self.obs)
         actions = take(self.actions)
         rewards = take(self.rewards)
         mus = take(self.mus)
@@ -0,0 +1,125 @@
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+
+def zeros(shape, dtype, storage_dir=None, name='array'):
+    """
+    Allocate a zero-filled array, either in memory or, if storage_dir is
+    given, as a memory-mapped .npy file in that directory.
+
+    Memory-mapped arrays let replay buffers grow far beyond RAM: pages
+    are loaded by the OS on access and can be evicted from the page cache
+    instead of being swapped. Arrays are laid out row-major with the
+    buffer index as the first axis, so every stored item is one
+    contiguous run of bytes. The file is unlinked right after it is
+    mapped, so it takes no space once the array is garbage collected.
+
+    shape: shape of the array
+    dtype: numpy dtype, may be structured
+    storage_dir: directory for the backing file, or None to keep the
+        array in memory
+    name: prefix of the backing file name
+    """
+    if storage_dir is None:
+        return np.zeros(shape, dtype=dtype)
+    os.makedirs(storage_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=name + '-', suffix='.npy', dir=storage_dir)
+    os.close(fd)
+    try:
+        # a fresh file is sparse, so it already reads as zeros
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+    finally:
+        os.unlink(path)
+
+
+def take(array, idxes):
+    """
+    array[idxes] for an integer index array along the first axis.
+
+    Memory-mapped arrays are read in ascending index order, so that
+    pages are touched sequentially, and the rows are put back in the
+    requested order afterwards.
+    """
+    idxes = np.asarray(idxes)
+    if not isinstance(array, np.memmap) or idxes.ndim != 1:
+        return array[idxes]
+    order = np.argsort(idxes, kind='mergesort')
+    out = np.empty((len(idxes),) + array.shape[1:], dtype=array.dtype)
+    out[order] = array[idxes[order]]
+    return out
+
+
+# Snapshots are written and copied in chunks of about this many bytes.
+CHUNK_BYTES = 64 * 2 ** 20
+
+
+def _chunk_rows(shape, dtype):
+    row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * np.dtype(dtype).itemsize
+    return max(1, CHUNK_BYTES // max(row_bytes, 1))
+
+
+def write_npy(path, chunks, shape, dtype):
+    """
+    Write a .npy file of the given shape and dtype from an iterable of
+    arrays that are consecutive runs of rows, so that the whole array
+    never has to be in memory at once.
+
+    The file is written next to path and then moved over it, so that
+    arrays memory-mapped from a previous file at path (see load), which
+    the chunks may come from, keep their data.
+    """
+    dtype = np.dtype(dtype)
+    header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': tuple(shape)}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.lib.format.write_array_header_1_0(f, header)
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+    os.replace(tmp_path, path)
+
+
+def save(path, array):
+    """
+    Write array (e.g. a memory-mapped one) to a .npy file in chunks of rows.
+    """
+    rows = _chunk_rows(array.shape, array.dtype)
+    chunks = (array[i:i + rows] for i in range(0, len(array), rows))
+    write_npy(path, chunks, array.shape, array.dtype)
+
+
+def load(path, size=None, storage_dir=None, name='array'):
+    """
+    Load an array saved with save.
+
+    If size is None or equals the number of saved rows and no
+    storage_dir is given, the file is memory-mapped copy-on-write: rows
+    are read lazily and changes are never written back to the file.
+    Otherwise a zeros(size, ..., storage_dir) array is allocated and the
+    saved rows are copied to its start in chunks.
+    """
+    saved = np.load(path, mmap_mode='c')
+    if storage_dir is None and (size is None or size == len(saved)):
+        return saved
+    size = len(saved) if size is None else size
+    assert len(saved) <= size, "snapshot has more rows than the array"
+    array = zeros((size,) + saved.shape[1:], saved.dtype, storage_dir, name)
+    rows = _chunk_rows(saved.shape, saved.dtype)
+    for i in range(0, len(saved), rows):
+        chunk = saved[i:i + rows]
+        array[i:i + len(chunk)] = chunk
+    return array
+
+
+def save_state(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def load_state(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -62,15 +62,52 @@ def unflatten_vector(vec, shapes):
 
 def discount_with_boundaries(X, New, gamma):
     """
-    X: 2d array of floats, time x features
-    New: 2d array of bools, indicating when a new episode has started
+    X: array of floats, time x features (any number of feature dimensions)
+    New: array of bools of the same shape, indicating when a new episode has started
+
+    Returns Y with Y[T-1] = X[T-1] and Y[t] = X[t] + gamma * Y[t+1] * (1 - New[t+1]).
+
+    Computed without a python loop: one lfilter pass gives the discounted
+    sums over the whole (reversed) sequence, from which the part that
+    leaks across each episode boundary is subtracted.
     """
-    Y = np.zeros_like(X)
+    X = np.asarray(X)
+    New = np.asarray(New)
     T = X.shape[0]
-    Y[T-1] = X[T-1]
-    for t in range(T-2, -1, -1):
-        Y[t] = X[t] + gamma * Y[t+1] * (1 - New[t+1])
-    return Y
+    # in reversed time, the sum restarts at every step that does not continue into the next one
+    restart = np.ones(X.shape, dtype=bool)
+    restart[:T-1] = New[1:] != 0
+    restart = restart[::-1]
+    x = X[::-1].astype(np.float64)
+    z = scipy.signal.lfilter([1], [1, -gamma], x, axis=0)
+    steps = np.arange(T).reshape((T,) + (1,) * (X.ndim - 1))
+    start = np.maximum.accumulate(np.where(restart, steps, 0), axis=0)
+    # z just before each start, 0 for the first segment
+    z_before = np.take_along_axis(np.concatenate([np.zeros_like(z[:1]), z]), start, axis=0)
+    y = z - gamma ** (steps - start + 1) * z_before
+    return y[::-1].astype(X.dtype if X.dtype.kind == 'f' else np.float64)
+
+def gae(rewards, values, news, last_values, last_news, gamma, lam):
+    """
+    Generalized advantage estimation, GAE(lambda), and TD(lambda) returns.
+
+    rewards, values, news: arrays of shape (T,) or (T, nenvs). news[t] is
+    1 if an episode started at step t, i.e. step t-1 was the last of its
+    episode and is not bootstrapped from step t.
+    last_values, last_news: value and new flag of the step after the last
+    one, of shape () or (nenvs,), used to bootstrap the last step.
+
+    returns advantages and returns (= advantages + values), both of the
+    shape of rewards.
+    """
+    rewards = np.asarray(rewards)
+    values = np.asarray(values)
+    news = np.asarray(news, dtype=np.float64)
+    nextnonterminal = 1.0 - np.concatenate([news[1:], np.asarray(last_news, dtype=np.float64)[None]])
+    nextvalues = np.concatenate([values[1:], np.asarray(last_values, dtype=values.dtype)[None]])
+    deltas = (rewards + gamma * nextvalues * nextnonterminal - values).astype(rewards.dtype)
+    advs = discount_with_boundaries(deltas, news, gamma * lam)
+    return advs, advs + values
 
 def test_discount_with_boundaries():
     gamma=0.9
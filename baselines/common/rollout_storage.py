@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class RolloutStorage(object):
+    """
+    Preallocated arrays for the data a runner collects in one rollout of
+    nsteps steps of nenvs environments.
+
+    Every field is an array of shape [nenvs, length, ...], allocated on
+    the first store() of that field and reused by later rollouts, so the
+    data of a step is written in place once instead of being appended to
+    lists, stacked and transposed. The env-major layout makes flat(),
+    the [nenvs * length, ...] training batch ordered by env, a view.
+
+    Arrays are overwritten by the next rollout: callers that keep the
+    data of a rollout while the next one is collected need one storage
+    per rollout in flight.
+    """
+    def __init__(self, nenvs, nsteps, dtypes=None, lengths=None):
+        """
+        nenvs: number of environments
+        nsteps: number of steps per rollout, the default length of a field
+        dtypes: optional {field: dtype}, by default a field keeps the dtype
+            of the first value stored
+        lengths: optional {field: length} for fields with another number
+            of entries than nsteps (e.g. nsteps + 1 with a final bootstrap
+            observation)
+        """
+        self.nenvs = nenvs
+        self.nsteps = nsteps
+        self.dtypes = dtypes or {}
+        self.lengths = lengths or {}
+        self.arrays = {}
+
+    def store(self, t, **fields):
+        """
+        Write the values of step t of all environments, given as
+        field=array of shape [nenvs, ...].
+        """
+        for name, value in fields.items():
+            if name not in self.arrays:
+                value = np.asarray(value)
+                shape = (self.nenvs, self.lengths.get(name, self.nsteps)) + value.shape[1:]
+                self.arrays[name] = np.zeros(shape, dtype=self.dtypes.get(name, value.dtype))
+            self.arrays[name][:, t] = value
+
+    def __getitem__(self, name):
+        """
+        The field as an array of shape [nenvs, length, ...].
+        """
+        return self.arrays[name]
+
+    def flat(self, name):
+        """
+        The field as a view of shape [nenvs * length, ...].
+        """
+        array = self.arrays[name]
+        return array.reshape((-1,) + array.shape[2:])
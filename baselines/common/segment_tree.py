@@ -1,4 +1,4 @@
-import operator
+import numpy as np
 
 
 class SegmentTree(object):
@@ -17,37 +17,29 @@ class SegmentTree(object):
                a contiguous subsequence of items in the
                array.
 
+        Nodes are stored in a flat numpy array (node `i` has children
+        `2 * i` and `2 * i + 1`, leaves start at `capacity`), so both
+        `__setitem__` and `__getitem__` also accept arrays of indices
+        and update / read many leaves at once.
+
         Paramters
         ---------
         capacity: int
             Total size of the array - must be a power of two.
-        operation: lambda obj, obj -> obj
-            and operation for combining elements (eg. sum, max)
+        operation: np.ufunc
+            and operation for combining elements (eg. np.add, np.minimum)
             must for a mathematical group together with the set of
             possible values for array elements.
+            Must work elementwise on numpy arrays.
         neutral_element: obj
             neutral element for the operation above. eg. float('-inf')
             for max and 0 for sum.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
-
-    def _reduce_helper(self, start, end, node, node_start, node_end):
-        if start == node_start and end == node_end:
-            return self._value[node]
-        mid = (node_start + node_end) // 2
-        if end <= mid:
-            return self._reduce_helper(start, end, 2 * node, node_start, mid)
-        else:
-            if mid + 1 <= start:
-                return self._reduce_helper(start, end, 2 * node + 1, mid + 1, node_end)
-            else:
-                return self._operation(
-                    self._reduce_helper(start, mid, 2 * node, node_start, mid),
-                    self._reduce_helper(mid + 1, end, 2 * node + 1, mid + 1, node_end)
-                )
+        self._neutral_element = neutral_element
 
     def reduce(self, start=0, end=None):
         """Returns result of applying `self.operation`
@@ -55,6 +47,8 @@ class SegmentTree(object):
 
             self.operation(arr[start], operation(arr[start+1], operation(... arr[end])))
 
+        Reducing over the whole array is O(1), it is read off the root.
+
         Parameters
         ----------
         start: int
@@ -71,23 +65,57 @@ class SegmentTree(object):
             end = self._capacity
         if end < 0:
             end += self._capacity
-        end -= 1
-        return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
+        if start == 0 and end == self._capacity:
+            return self._value[1]
+        # iterative bottom-up walk over the half-open range [start, end)
+        result = self._neutral_element
+        start += self._capacity
+        end += self._capacity
+        while start < end:
+            if start & 1:
+                result = self._operation(result, self._value[start])
+                start += 1
+            if end & 1:
+                end -= 1
+                result = self._operation(result, self._value[end])
+            start //= 2
+            end //= 2
+        return result
 
     def __setitem__(self, idx, val):
-        # index of the leaf
-        idx += self._capacity
+        if np.isscalar(idx):
+            # index of the leaf
+            idx += self._capacity
+            self._value[idx] = val
+            idx //= 2
+            while idx >= 1:
+                self._value[idx] = self._operation(
+                    self._value[2 * idx],
+                    self._value[2 * idx + 1]
+                )
+                idx //= 2
+            return
+
+        # batched update: all leaves live on the same level, so the set of
+        # touched parents can be recomputed one level at a time
+        idx = np.asarray(idx, dtype=np.int64) + self._capacity
+        if idx.size == 0:
+            return
         self._value[idx] = val
-        idx //= 2
-        while idx >= 1:
+        idx = np.unique(idx // 2)
+        while idx[0] >= 1:
             self._value[idx] = self._operation(
                 self._value[2 * idx],
                 self._value[2 * idx + 1]
             )
-            idx //= 2
+            idx = np.unique(idx // 2)
 
     def __getitem__(self, idx):
-        assert 0 <= idx < self._capacity
+        if np.isscalar(idx):
+            assert 0 <= idx < self._capacity
+        else:
+            idx = np.asarray(idx, dtype=np.int64)
+            assert np.all(0 <= idx) and np.all(idx < self._capacity)
         return self._value[self._capacity + idx]
 
 
@@ -95,7 +123,7 @@ class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
-            operation=operator.add,
+            operation=np.add,
             neutral_element=0.0
         )
 
@@ -113,30 +141,35 @@ class SumSegmentTree(SegmentTree):
 
         Parameters
         ----------
-        perfixsum: float
-            upperbound on the sum of array prefix
+        perfixsum: float or np.array
+            upperbound on the sum of array prefix. If an array is
+            passed all of its entries descend the tree together.
 
         Returns
         -------
-        idx: int
+        idx: int or np.array
             highest index satisfying the prefixsum constraint
+            (an array of dtype np.int64 if prefixsum is an array)
         """
-        assert 0 <= prefixsum <= self.sum() + 1e-5
-        idx = 1
-        while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
-                idx = 2 * idx
-            else:
-                prefixsum -= self._value[2 * idx]
-                idx = 2 * idx + 1
-        return idx - self._capacity
+        scalar = np.isscalar(prefixsum)
+        prefixsum = np.array(prefixsum, dtype=np.float64, ndmin=1)
+        assert np.all(0 <= prefixsum) and np.all(prefixsum <= self.sum() + 1e-5)
+        idx = np.ones(prefixsum.shape, dtype=np.int64)
+        while idx.size > 0 and idx[0] < self._capacity:  # while non-leaf
+            left = 2 * idx
+            left_value = self._value[left]
+            go_right = left_value <= prefixsum
+            prefixsum -= np.where(go_right, left_value, 0.0)
+            idx = left + go_right
+        idx -= self._capacity
+        return int(idx[0]) if scalar else idx
 
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
-            operation=min,
+            operation=np.minimum,
             neutral_element=float('inf')
         )
 
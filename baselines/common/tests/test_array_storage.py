@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+
+from baselines.common import array_storage
+
+
+def test_zeros_in_memory():
+    array = array_storage.zeros((4, 3), np.float32)
+    assert not isinstance(array, np.memmap)
+    assert array.shape == (4, 3) and array.dtype == np.float32
+    assert not array.any()
+
+
+def test_zeros_memory_mapped(tmpdir):
+    array = array_storage.zeros((100, 2), np.uint8, str(tmpdir), 'obs')
+    assert isinstance(array, np.memmap)
+    assert array.shape == (100, 2) and not array.any()
+    # the backing file is unlinked right away
+    assert os.listdir(str(tmpdir)) == []
+    array[7] = 3
+    assert array[7].tolist() == [3, 3]
+
+
+def test_take():
+    np.random.seed(0)
+    values = np.random.randn(50, 3)
+    idxes = np.random.randint(0, 50, size=30)
+    assert np.array_equal(array_storage.take(values, idxes), values[idxes])
+
+
+def test_take_memory_mapped(tmpdir):
+    np.random.seed(1)
+    array = array_storage.zeros((50, 3), np.float64, str(tmpdir))
+    array[:] = np.random.randn(50, 3)
+    idxes = np.random.randint(0, 50, size=30)
+    taken = array_storage.take(array, idxes)
+    assert not isinstance(taken, np.memmap)
+    assert np.array_equal(taken, np.asarray(array)[idxes])
@@ -0,0 +1,72 @@
+import numpy as np
+
+from baselines.common.math_util import discount_with_boundaries, gae
+
+
+def gae_loop(rewards, values, news, last_values, last_news, gamma, lam):
+    T = len(rewards)
+    advs = np.zeros_like(rewards)
+    lastgaelam = 0
+    for t in reversed(range(T)):
+        if t == T - 1:
+            nextnonterminal = 1.0 - last_news
+            nextvalues = last_values
+        else:
+            nextnonterminal = 1.0 - news[t+1]
+            nextvalues = values[t+1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advs[t] = lastgaelam = delta + gamma * lam * nextnonterminal * lastgaelam
+    return advs
+
+
+def test_discount_with_boundaries():
+    gamma = 0.9
+    x = np.array([1.0, 2.0, 3.0, 4.0], 'float32')
+    starts = [1.0, 0.0, 0.0, 1.0]
+    y = discount_with_boundaries(x, starts, gamma)
+    assert y.dtype == np.float32
+    assert np.allclose(y, [
+        1 + gamma * 2 + gamma**2 * 3,
+        2 + gamma * 3,
+        3,
+        4
+    ])
+
+
+def test_discount_with_boundaries_2d():
+    np.random.seed(0)
+    x = np.random.randn(50, 3)
+    new = np.random.rand(50, 3) < 0.1
+    y = discount_with_boundaries(x, new, 0.99)
+    for j in range(3):
+        expected = np.zeros(50)
+        expected[-1] = x[-1, j]
+        for t in range(48, -1, -1):
+            expected[t] = x[t, j] + 0.99 * expected[t+1] * (1 - new[t+1, j])
+        assert np.allclose(y[:, j], expected)
+
+
+def test_gae():
+    np.random.seed(0)
+    T, nenvs = 200, 4
+    rewards = np.random.randn(T, nenvs).astype(np.float32)
+    values = np.random.randn(T, nenvs).astype(np.float32)
+    news = np.random.rand(T, nenvs) < 0.05
+    last_values = np.random.randn(nenvs).astype(np.float32)
+    last_news = np.array([True, False, True, False])
+    advs, returns = gae(rewards, values, news, last_values, last_news, 0.99, 0.95)
+    expected = gae_loop(rewards, values, news, last_values, last_news, 0.99, 0.95)
+    assert advs.dtype == np.float32 and advs.shape == (T, nenvs)
+    assert np.allclose(advs, expected, atol=1e-4)
+    assert np.allclose(returns, expected + values, atol=1e-4)
+
+
+def test_gae_1d():
+    np.random.seed(1)
+    T = 1000
+    rewards = np.random.randn(T)
+    values = np.random.randn(T)
+    news = np.random.rand(T) < 0.01
+    for lam in [0.0, 0.95, 1.0]:
+        advs, _ = gae(rewards, values, news, 0.5, 0, 1.0, lam)
+        assert np.allclose(advs, gae_loop(rewards, values, news, 0.5, 0, 1.0, lam))
@@ -95,9 +95,55 @@ def test_max_interval_tree():
     assert np.isclose(tree.min(3, 4), 3.0)
 
 
+def test_tree_set_batch():
+    tree = SumSegmentTree(8)
+    ref = SumSegmentTree(8)
+
+    idxes = np.array([1, 5, 2, 5, 7])
+    vals = np.array([0.5, 1.0, 2.0, 3.0, 0.25])
+    tree[idxes] = vals
+    for idx, val in zip(idxes, vals):
+        ref[idx] = val
+
+    assert np.allclose(tree[np.arange(8)], ref[np.arange(8)])
+    assert np.isclose(tree[5], 3.0)
+    assert np.isclose(tree.sum(), 5.75)
+    for start in range(8):
+        for end in range(start + 1, 9):
+            assert np.isclose(tree.sum(start, end), ref.sum(start, end))
+
+
+def test_prefixsum_idx_batch():
+    tree = SumSegmentTree(4)
+
+    tree[np.arange(4)] = [0.5, 1.0, 1.0, 3.0]
+
+    prefixsums = np.array([0.00, 0.55, 0.99, 1.51, 3.00, 5.50])
+    idxes = tree.find_prefixsum_idx(prefixsums)
+    assert list(idxes) == [0, 1, 1, 2, 3, 3]
+    assert list(idxes) == [tree.find_prefixsum_idx(p) for p in prefixsums]
+    assert len(tree.find_prefixsum_idx(np.array([]))) == 0
+
+
+def test_min_tree_set_batch():
+    tree = MinSegmentTree(4)
+
+    tree[np.array([0, 2, 3])] = [1.0, 0.5, 3.0]
+    assert np.isclose(tree.min(), 0.5)
+    assert np.isclose(tree.min(0, 2), 1.0)
+    assert np.isclose(tree.min(3, 4), 3.0)
+
+    tree[np.array([2])] = [4.0]
+    assert np.isclose(tree.min(), 1.0)
+    assert np.isclose(tree.min(2, -1), 4.0)
+
+
 if __name__ == '__main__':
     test_tree_set()
     test_tree_set_overlap()
     test_prefixsum_idx()
     test_prefixsum_idx2()
     test_max_interval_tree()
+    test_tree_set_batch()
+    test_prefixsum_idx_batch()
+    test_min_tree_set_batch()
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import numpy as np
 from baselines import logger
 
 class AlreadySteppingError(Exception):
@@ -77,6 +78,44 @@ class VecEnv(ABC):
         self.step_async(actions)
         return self.step_wait()
 
+    def step_send(self, actions, env_ids=None):
+        """
+        Tell the environments env_ids (all of them if None)
+        to start taking a step with the given actions, one
+        action per entry of env_ids.
+        Call step_recv() to get the results as they finish.
+
+        You should not call this for an environment which
+        has a step pending.
+
+        The default implementation can only step all the
+        environments at once.
+        """
+        if env_ids is not None and list(env_ids) != list(range(self.num_envs)):
+            raise NotImplementedError('%s cannot step a subset of its environments'%self)
+        self.step_async(actions)
+
+    def step_recv(self, min_ready=None, timeout=None):
+        """
+        Wait for environments stepped with step_send().
+
+        Returns as soon as at least min_ready of the pending
+        environments (all of them if None) have finished, or
+        once timeout seconds have passed, whichever comes
+        first. Every environment that has finished by then is
+        returned, so there may be more than min_ready of them,
+        or less if the timeout expired.
+
+        Returns (env_ids, obs, rews, dones, infos), where
+        env_ids is an array with the indices of the finished
+        environments and the other entries are as in
+        step_wait(), restricted to those environments.
+
+        The default implementation waits for all environments.
+        """
+        obs, rews, dones, infos = self.step_wait()
+        return np.arange(self.num_envs), obs, rews, dones, infos
+
     def render(self):
         logger.warn('Render not defined for %s'%self)
 
@@ -3,14 +3,26 @@ import gym
 from . import VecEnv
 
 class DummyVecEnv(VecEnv):
-    def __init__(self, env_fns):
+    def __init__(self, env_fns, copy_obs=True):
+        """
+        env_fns: list of functions creating the environments
+        copy_obs: if False, observations are returned as read-only views
+            into two sets of buffers used on alternate steps, instead of
+            copies. A returned observation stays valid until the second
+            step_wait() / reset() after it, which is enough for runners
+            that copy it into their own storage before stepping again.
+            Rewards and dones are always copied.
+        """
         self.envs = [fn() for fn in env_fns]
         env = self.envs[0]
         VecEnv.__init__(self, len(env_fns), env.observation_space, env.action_space)
 
         obs_spaces = self.observation_space.spaces if isinstance(self.observation_space, gym.spaces.Tuple) else (self.observation_space,)
-        self.buf_obs = [np.zeros((self.num_envs,) + tuple(s.shape), s.dtype) for s in obs_spaces]
-        self.buf_dones = np.zeros((self.num_envs,), dtype=np.bool)
+        self.copy_obs = copy_obs
+        self.obs_bufs = [[np.zeros((self.num_envs,) + tuple(s.shape), s.dtype) for s in obs_spaces]
+            for _ in range(1 if copy_obs else 2)]
+        self.buf_obs = self.obs_bufs[0]
+        self.buf_dones = np.zeros((self.num_envs,), dtype=np.bool_)
         self.buf_rews  = np.zeros((self.num_envs,), dtype=np.float32)
         self.buf_infos = [{} for _ in range(self.num_envs)]
         self.actions = None
@@ -19,33 +31,54 @@ class DummyVecEnv(VecEnv):
         self.actions = actions
 
     def step_wait(self):
+        self._swap_obs_buf()
         for i in range(self.num_envs):
-            obs_tuple, self.buf_rews[i], self.buf_dones[i], self.buf_infos[i] = self.envs[i].step(self.actions[i])
-            if self.buf_dones[i]:
-                obs_tuple = self.envs[i].reset()
-            if isinstance(obs_tuple, (tuple, list)):
-                for t,x in enumerate(obs_tuple):
-                    self.buf_obs[t][i] = x
-            else:
-                self.buf_obs[0][i] = obs_tuple
-        return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones),
-                self.buf_infos.copy())
+            self._step_env(i)
+        return self._step_results()
 
     def reset(self):
+        self._swap_obs_buf()
         for i in range(self.num_envs):
-            obs_tuple = self.envs[i].reset()
-            if isinstance(obs_tuple, (tuple, list)):
-                for t,x in enumerate(obs_tuple):
-                    self.buf_obs[t][i] = x
-            else:
-                self.buf_obs[0][i] = obs_tuple
+            self._reset_env(i)
         return self._obs_from_buf()
 
+    def _step_env(self, i):
+        obs_tuple, self.buf_rews[i], self.buf_dones[i], self.buf_infos[i] = self.envs[i].step(self.actions[i])
+        if self.buf_dones[i]:
+            obs_tuple = self.envs[i].reset()
+        self._save_obs(i, obs_tuple)
+
+    def _reset_env(self, i):
+        self._save_obs(i, self.envs[i].reset())
+
+    def _save_obs(self, i, obs_tuple):
+        if isinstance(obs_tuple, (tuple, list)):
+            for t,x in enumerate(obs_tuple):
+                self.buf_obs[t][i] = x
+        else:
+            self.buf_obs[0][i] = obs_tuple
+
+    def _step_results(self):
+        return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones),
+                self.buf_infos.copy())
+
     def close(self):
         return
 
+    def _swap_obs_buf(self):
+        # write into the buffers that were not handed out last time
+        if not self.copy_obs:
+            self.obs_bufs.reverse()
+            self.buf_obs = self.obs_bufs[0]
+
+    def _readonly_view(self, x):
+        x = x.view()
+        x.flags.writeable = False
+        return x
+
     def _obs_from_buf(self):
+        get = np.copy if self.copy_obs else self._readonly_view
         if len(self.buf_obs) == 1:
-            return np.copy(self.buf_obs[0])
+            return get(self.buf_obs[0])
         else:
-            return tuple(np.copy(x) for x in self.buf_obs)
+            return tuple(get(x) for x in self.buf_obs)
@@ -1,80 +1,196 @@
+import time
 import numpy as np
-from multiprocessing import Process, Pipe
-from baselines.common.vec_env import VecEnv, CloudpickleWrapper
+from multiprocessing import Process, Pipe, RawArray
+from multiprocessing.connection import wait
+from baselines.common.vec_env import VecEnv, CloudpickleWrapper, AlreadySteppingError, NotSteppingError
 
 
-def worker(remote, parent_remote, env_fn_wrapper):
+def obs_buffer_view(obs_buf, obs_space):
+    """
+    View a shared byte buffer as a (num_envs,) + obs_space.shape array.
+    """
+    dtype = np.dtype(obs_space.dtype)
+    return np.frombuffer(obs_buf, dtype=dtype).reshape((-1,) + tuple(obs_space.shape))
+
+
+def worker(remote, parent_remote, env_fn_wrapper, obs_buf=None, env_slice=None):
     parent_remote.close()
-    env = env_fn_wrapper.x()
+    envs = [env_fn() for env_fn in env_fn_wrapper.x]
+    if obs_buf is not None:
+        shared_obs = obs_buffer_view(obs_buf, envs[0].observation_space)[env_slice]
+
+    def pack(obs):
+        # with shared memory the observations are written in place and
+        # only the small control message goes through the pipe
+        if obs_buf is None:
+            return obs
+        shared_obs[...] = obs
+        return None
+
+    def step_env(env, action):
+        ob, reward, done, info = env.step(action)
+        if done:
+            ob = env.reset()
+        return ob, reward, done, info
+
     while True:
         cmd, data = remote.recv()
         if cmd == 'step':
-            ob, reward, done, info = env.step(data)
-            if done:
-                ob = env.reset()
-            remote.send((ob, reward, done, info))
+            obs, rews, dones, infos = zip(*[step_env(env, action) for env, action in zip(envs, data)])
+            remote.send((pack(obs), rews, dones, infos))
         elif cmd == 'reset':
-            ob = env.reset()
-            remote.send(ob)
+            remote.send(pack([env.reset() for env in envs]))
         elif cmd == 'reset_task':
-            ob = env.reset_task()
-            remote.send(ob)
+            remote.send(pack([env.reset_task() for env in envs]))
         elif cmd == 'close':
             remote.close()
             break
         elif cmd == 'get_spaces':
-            remote.send((env.observation_space, env.action_space))
+            remote.send((envs[0].observation_space, envs[0].action_space))
         else:
             raise NotImplementedError
 
 
+def flatten(results):
+    return [x for worker_results in results for x in worker_results]
+
+
 class SubprocVecEnv(VecEnv):
-    def __init__(self, env_fns, spaces=None):
+    def __init__(self, env_fns, spaces=None, shared_memory=False, envs_per_worker=1):
         """
         envs: list of gym environments to run in subprocesses
+        spaces: optional (observation_space, action_space) tuple. If not
+            given it is queried from the first environment.
+        shared_memory: if True, workers write observations straight into a
+            preallocated (num_envs,) + obs_shape buffer in shared memory
+            instead of pickling them through the pipe. Requires a single
+            array observation space.
+        envs_per_worker: number of consecutive environments hosted and
+            stepped serially by every subprocess, so that one message
+            round-trip covers all of them.
         """
-        self.waiting = False
         self.closed = False
         nenvs = len(env_fns)
-        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(nenvs)])
-        self.ps = [Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
-            for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)]
+        self.shared_memory = shared_memory
+        self.obs_buf = None
+        if shared_memory:
+            if spaces is None:
+                # the buffer has to exist before the workers are started
+                env = env_fns[0]()
+                spaces = env.observation_space, env.action_space
+                env.close()
+            observation_space = spaces[0]
+            nbytes = nenvs * int(np.prod(observation_space.shape)) * np.dtype(observation_space.dtype).itemsize
+            self.obs_buf = RawArray('B', nbytes)
+            self.buf_obs = obs_buffer_view(self.obs_buf, observation_space)
+        self.env_slices = [slice(start, min(start + envs_per_worker, nenvs))
+            for start in range(0, nenvs, envs_per_worker)]
+        self.remotes, self.work_remotes = zip(*[Pipe() for _ in self.env_slices])
+        # which workers have a step in flight
+        self.pending = [False] * len(self.remotes)
+        self.ps = [Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(env_fns[env_slice]), self.obs_buf, env_slice))
+            for (work_remote, remote, env_slice) in zip(self.work_remotes, self.remotes, self.env_slices)]
         for p in self.ps:
             p.daemon = True # if the main process crashes, we should not cause things to hang
             p.start()
         for remote in self.work_remotes:
             remote.close()
 
-        self.remotes[0].send(('get_spaces', None))
-        observation_space, action_space = self.remotes[0].recv()
+        if spaces is None:
+            self.remotes[0].send(('get_spaces', None))
+            spaces = self.remotes[0].recv()
+        observation_space, action_space = spaces
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
 
+    def _stack_obs(self, obs):
+        if self.shared_memory:
+            return self.buf_obs.copy()
+        return np.stack(flatten(obs))
+
     def step_async(self, actions):
-        for remote, action in zip(self.remotes, actions):
-            remote.send(('step', action))
-        self.waiting = True
+        if any(self.pending):
+            raise AlreadySteppingError()
+        for remote, env_slice in zip(self.remotes, self.env_slices):
+            remote.send(('step', actions[env_slice]))
+        self.pending = [True] * len(self.remotes)
 
     def step_wait(self):
+        if not all(self.pending):
+            raise NotSteppingError()
         results = [remote.recv() for remote in self.remotes]
-        self.waiting = False
+        self.pending = [False] * len(self.remotes)
         obs, rews, dones, infos = zip(*results)
-        return np.stack(obs), np.stack(rews), np.stack(dones), infos
+        return self._stack_obs(obs), np.stack(flatten(rews)), np.stack(flatten(dones)), tuple(flatten(infos))
+
+    def step_send(self, actions, env_ids=None):
+        """
+        See VecEnv.step_send. With envs_per_worker > 1, env_ids must
+        cover whole worker slices, as a worker steps all its envs together.
+        """
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        env_actions = dict(zip(env_ids, actions))
+        assert len(env_actions) == len(actions)
+        for i, env_slice in enumerate(self.env_slices):
+            slice_ids = range(env_slice.start, env_slice.stop)
+            if slice_ids[0] not in env_actions:
+                continue
+            assert all(env_id in env_actions for env_id in slice_ids), \
+                'env_ids must cover whole worker slices'
+            if self.pending[i]:
+                raise AlreadySteppingError()
+            self.remotes[i].send(('step', [env_actions.pop(env_id) for env_id in slice_ids]))
+            self.pending[i] = True
+        assert not env_actions, 'unknown env_ids {}'.format(sorted(env_actions))
+
+    def step_recv(self, min_ready=None, timeout=None):
+        """
+        See VecEnv.step_recv.
+        """
+        pending = [remote for remote, p in zip(self.remotes, self.pending) if p]
+        if not pending:
+            raise NotSteppingError()
+        min_ready = len(pending) if min_ready is None else min(min_ready, len(pending))
+        deadline = None if timeout is None else time.time() + timeout
+        ready = []
+        while True:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            ready.extend(wait([remote for remote in pending if remote not in ready], remaining))
+            if len(ready) >= min_ready or (deadline is not None and time.time() >= deadline):
+                break
+
+        env_ids, results = [], []
+        for i, remote in enumerate(self.remotes):
+            if remote in ready:
+                results.append(remote.recv())
+                self.pending[i] = False
+                env_ids.extend(range(self.env_slices[i].start, self.env_slices[i].stop))
+        env_ids = np.array(env_ids, dtype=np.int64)
+        if not results:
+            obs = np.empty((0,) + tuple(self.observation_space.shape), dtype=self.observation_space.dtype)
+            return env_ids, obs, np.empty((0,)), np.empty((0,), dtype=np.bool_), ()
+        obs, rews, dones, infos = zip(*results)
+        if self.shared_memory:
+            obs = self.buf_obs[env_ids]
+        else:
+            obs = np.stack(flatten(obs))
+        return env_ids, obs, np.stack(flatten(rews)), np.stack(flatten(dones)), tuple(flatten(infos))
 
     def reset(self):
         for remote in self.remotes:
             remote.send(('reset', None))
-        return np.stack([remote.recv() for remote in self.remotes])
+        return self._stack_obs([remote.recv() for remote in self.remotes])
 
     def reset_task(self):
         for remote in self.remotes:
             remote.send(('reset_task', None))
-        return np.stack([remote.recv() for remote in self.remotes])
+        return self._stack_obs([remote.recv() for remote in self.remotes])
 
     def close(self):
         if self.closed:
             return
-        if self.waiting:
-            for remote in self.remotes:            
+        for remote, pending in zip(self.remotes, self.pending):
+            if pending:
                 remote.recv()
         for remote in self.remotes:
             remote.send(('close', None))
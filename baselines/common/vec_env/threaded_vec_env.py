@@ -0,0 +1,65 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from baselines.common.vec_env import AlreadySteppingError, NotSteppingError
+from baselines.common.vec_env.dummy_vec_env import DummyVecEnv
+
+class ThreadedVecEnv(DummyVecEnv):
+    def __init__(self, env_fns, num_threads=None, copy_obs=True):
+        """
+        Steps the environments on a pool of threads, each thread
+        handling a contiguous slice of them and writing the results
+        straight into the shared buffers of DummyVecEnv.
+
+        Only gives a speedup for simulators that release the GIL
+        while stepping (e.g. mujoco_py, ALE), and avoids the
+        pickling and process overhead of SubprocVecEnv.
+
+        env_fns: list of functions creating the environments
+        num_threads: size of the thread pool, defaults to
+            min(num_envs, cpu count)
+        copy_obs: see DummyVecEnv
+        """
+        DummyVecEnv.__init__(self, env_fns, copy_obs=copy_obs)
+        if num_threads is None:
+            num_threads = min(self.num_envs, multiprocessing.cpu_count())
+        self.env_slices = [(s[0], s[-1] + 1) for s in np.array_split(np.arange(self.num_envs), num_threads) if len(s) > 0]
+        self.pool = ThreadPoolExecutor(max_workers=len(self.env_slices))
+        self.futures = None
+
+    def _run(self, fn):
+        def run_slice(start, end):
+            for i in range(start, end):
+                fn(i)
+        return [self.pool.submit(run_slice, start, end) for start, end in self.env_slices]
+
+    def _wait(self):
+        futures, self.futures = self.futures, None
+        for future in futures:
+            future.result() # re-raises exceptions from the worker threads
+
+    def step_async(self, actions):
+        if self.futures is not None:
+            raise AlreadySteppingError()
+        self.actions = actions
+        self._swap_obs_buf()
+        self.futures = self._run(self._step_env)
+
+    def step_wait(self):
+        if self.futures is None:
+            raise NotSteppingError()
+        self._wait()
+        return self._step_results()
+
+    def reset(self):
+        if self.futures is not None:
+            self._wait()
+        self._swap_obs_buf()
+        self.futures = self._run(self._reset_env)
+        self._wait()
+        return self._obs_from_buf()
+
+    def close(self):
+        if self.futures is not None:
+            self._wait()
+        self.pool.shutdown()
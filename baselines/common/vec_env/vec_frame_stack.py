@@ -2,37 +2,92 @@ from baselines.common.vec_env import VecEnvWrapper
 import numpy as np
 from gym import spaces
 
+class FrameStackRing(object):
+    """
+    The nstack most recent frames of a batch of environments,
+    stacked along the last axis.
+
+    Every new frame is written into the next slot of a ring
+    instead of shifting the whole stack. Each frame is stored
+    twice, nstack slots apart, so the stack (oldest frame first)
+    is always a contiguous window of channels and can be
+    returned as a view without reordering.
+    """
+    def __init__(self, nenvs, frame_shape, nstack, dtype):
+        self.nstack = nstack
+        self.nc = frame_shape[-1]
+        self.buf = np.zeros((nenvs,) + tuple(frame_shape[:-1]) + (2 * nstack * self.nc,), dtype)
+        self.pos = nstack - 1 # slot of the newest frame
+
+    def reset(self):
+        self.buf[...] = 0
+
+    def push(self, frames, dones=None):
+        """
+        Append frames, after zeroing the stacks of the environments
+        for which dones is set.
+        """
+        if dones is not None:
+            dones = np.asarray(dones, dtype=np.bool_)
+            if dones.any():
+                self.buf[dones] = 0
+        self.pos = (self.pos + 1) % self.nstack
+        for slot in (self.pos, self.pos + self.nstack):
+            self.buf[..., slot * self.nc:(slot + 1) * self.nc] = frames
+
+    def view(self):
+        """
+        The stacked frames as a view, only valid until the next push().
+        """
+        start = (self.pos + 1) * self.nc
+        return self.buf[..., start:start + self.nstack * self.nc]
+
+    def stacked(self):
+        """
+        A copy of the stacked frames.
+        """
+        return self.view().copy()
+
 class VecFrameStack(VecEnvWrapper):
     """
     Vectorized environment base class
     """
-    def __init__(self, venv, nstack):
+    def __init__(self, venv, nstack, copy=True):
+        """
+        copy: if False, the returned observations are views into the frame
+            ring which change on the next step_wait() / reset(). Use when
+            the caller copies them anyway, to save a full copy per step.
+        """
         self.venv = venv
         self.nstack = nstack
+        self.copy = copy
         wos = venv.observation_space # wrapped ob space
         low = np.repeat(wos.low, self.nstack, axis=-1)
         high = np.repeat(wos.high, self.nstack, axis=-1)
-        self.stackedobs = np.zeros((venv.num_envs,)+low.shape, low.dtype)
+        self.frames = FrameStackRing(venv.num_envs, wos.shape, nstack, low.dtype)
         observation_space = spaces.Box(low=low, high=high, dtype=venv.observation_space.dtype)
         VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
 
+    @property
+    def stackedobs(self):
+        return self.frames.view()
+
+    def _get_obs(self):
+        return self.frames.stacked() if self.copy else self.frames.view()
+
     def step_wait(self):
         obs, rews, news, infos = self.venv.step_wait()
-        self.stackedobs = np.roll(self.stackedobs, shift=-1, axis=-1)
-        for (i, new) in enumerate(news):
-            if new:
-                self.stackedobs[i] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
-        return self.stackedobs, rews, news, infos
+        self.frames.push(obs, news)
+        return self._get_obs(), rews, news, infos
 
     def reset(self):
         """
         Reset all environments
         """
         obs = self.venv.reset()
-        self.stackedobs[...] = 0
-        self.stackedobs[..., -obs.shape[-1]:] = obs
-        return self.stackedobs
+        self.frames.reset()
+        self.frames.push(obs)
+        return self._get_obs()
 
     def close(self):
         self.venv.close()
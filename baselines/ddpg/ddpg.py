@@ -252,24 +252,39 @@ class DDPG(object):
         self.stats_ops = ops
         self.stats_names = names
 
-    def pi(self, obs, apply_noise=True, compute_Q=True):
+    def _policy(self, obs, apply_noise, compute_Q):
         if self.param_noise is not None and apply_noise:
             actor_tf = self.perturbed_actor_tf
         else:
             actor_tf = self.actor_tf
-        feed_dict = {self.obs0: [obs]}
+        feed_dict = {self.obs0: obs}
         if compute_Q:
             action, q = self.sess.run([actor_tf, self.critic_with_actor_tf], feed_dict=feed_dict)
         else:
             action = self.sess.run(actor_tf, feed_dict=feed_dict)
             q = None
-        action = action.flatten()
+        return action, q
+
+    def _add_action_noise(self, action, apply_noise):
         if self.action_noise is not None and apply_noise:
             noise = self.action_noise()
             assert noise.shape == action.shape
             action += noise
         action = np.clip(action, self.action_range[0], self.action_range[1])
-        return action, q
+        return action
+
+    def pi(self, obs, apply_noise=True, compute_Q=True):
+        action, q = self._policy([obs], apply_noise, compute_Q)
+        action = action.flatten()
+        return self._add_action_noise(action, apply_noise), q
+
+    def pi_batch(self, obs, apply_noise=True, compute_Q=True):
+        """Like pi, but for a batch of observations (e.g. one per env of a VecEnv),
+        evaluated in a single session run. The action noise, if any, has to
+        produce one sample per observation, i.e. be built with a mu of shape
+        (batch size,) + action shape."""
+        action, q = self._policy(obs, apply_noise, compute_Q)
+        return self._add_action_noise(action, apply_noise), q
 
     def store_transition(self, obs0, action, reward, obs1, terminal1):
         reward *= self.reward_scale
@@ -277,6 +292,14 @@ class DDPG(object):
         if self.normalize_observations:
             self.obs_rms.update(np.array([obs0]))
 
+    def store_transitions(self, obs0, actions, rewards, obs1, terminals1):
+        """Bulk version of store_transition, every argument has the
+        number of transitions as its first dimension."""
+        rewards = np.asarray(rewards) * self.reward_scale
+        self.memory.extend(obs0, actions, rewards, obs1, terminals1)
+        if self.normalize_observations:
+            self.obs_rms.update(np.asarray(obs0))
+
     def train(self):
         # Get a batch.
         batch = self.memory.sample(batch_size=self.batch_size)
@@ -368,10 +391,18 @@ class DDPG(object):
         self.param_noise.adapt(mean_distance)
         return mean_distance
 
-    def reset(self):
+    def reset(self, idxs=None):
         # Reset internal state after an episode is complete.
+        # idxs selects the rows of a batched action noise to reset (all if None).
+        # The perturbed actor is shared by all envs, so it is only resampled
+        # when all of them are reset, see perturb_policy.
         if self.action_noise is not None:
-            self.action_noise.reset()
+            self.action_noise.reset(idxs)
+        if idxs is None:
+            self.perturb_policy()
+
+    def perturb_policy(self):
+        # Resample the parameter noise of the perturbed actor.
         if self.param_noise is not None:
             self.sess.run(self.perturb_policy_ops, feed_dict={
                 self.param_noise_stddev: self.param_noise.current_stddev,
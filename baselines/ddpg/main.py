@@ -8,6 +8,7 @@ from baselines.common.misc_util import (
     boolean_flag,
 )
 import baselines.ddpg.training as training
+from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
 from baselines.ddpg.models import Actor, Critic
 from baselines.ddpg.memory import Memory
 from baselines.ddpg.noise import *
@@ -16,20 +17,30 @@ import gym
 import tensorflow as tf
 from mpi4py import MPI
 
-def run(env_id, seed, noise_type, layer_norm, evaluation, **kwargs):
+def run(env_id, seed, noise_type, layer_norm, evaluation, num_envs, memory_dir, **kwargs):
     # Configure things.
     rank = MPI.COMM_WORLD.Get_rank()
     if rank != 0:
         logger.set_level(logger.DISABLED)
 
     # Create envs.
-    env = gym.make(env_id)
-    env = bench.Monitor(env, logger.get_dir() and os.path.join(logger.get_dir(), str(rank)))
+    if num_envs > 1:
+        def make_env(i):
+            def _thunk():
+                env = gym.make(env_id)
+                env.seed(seed + 1000000 * rank + i)
+                return bench.Monitor(env, logger.get_dir() and os.path.join(logger.get_dir(), '{}.{}'.format(rank, i)))
+            return _thunk
+        env = SubprocVecEnv([make_env(i) for i in range(num_envs)])
+    else:
+        env = gym.make(env_id)
+        env = bench.Monitor(env, logger.get_dir() and os.path.join(logger.get_dir(), str(rank)))
 
     if evaluation and rank==0:
         eval_env = gym.make(env_id)
         eval_env = bench.Monitor(eval_env, os.path.join(logger.get_dir(), 'gym_eval'))
-        env = bench.Monitor(env, None)
+        if num_envs == 1:
+            env = bench.Monitor(env, None)
     else:
         eval_env = None
 
@@ -37,6 +48,8 @@ def run(env_id, seed, noise_type, layer_norm, evaluation, **kwargs):
     action_noise = None
     param_noise = None
     nb_actions = env.action_space.shape[-1]
+    # With several envs every env gets its own row of action noise.
+    noise_shape = (num_envs, nb_actions) if num_envs > 1 else (nb_actions,)
     for current_noise_type in noise_type.split(','):
         current_noise_type = current_noise_type.strip()
         if current_noise_type == 'none':
@@ -46,15 +59,16 @@ def run(env_id, seed, noise_type, layer_norm, evaluation, **kwargs):
             param_noise = AdaptiveParamNoiseSpec(initial_stddev=float(stddev), desired_action_stddev=float(stddev))
         elif 'normal' in current_noise_type:
             _, stddev = current_noise_type.split('_')
-            action_noise = NormalActionNoise(mu=np.zeros(nb_actions), sigma=float(stddev) * np.ones(nb_actions))
+            action_noise = NormalActionNoise(mu=np.zeros(noise_shape), sigma=float(stddev) * np.ones(noise_shape))
         elif 'ou' in current_noise_type:
             _, stddev = current_noise_type.split('_')
-            action_noise = OrnsteinUhlenbeckActionNoise(mu=np.zeros(nb_actions), sigma=float(stddev) * np.ones(nb_actions))
+            action_noise = OrnsteinUhlenbeckActionNoise(mu=np.zeros(noise_shape), sigma=float(stddev) * np.ones(noise_shape))
         else:
             raise RuntimeError('unknown noise type "{}"'.format(current_noise_type))
 
     # Configure components.
-    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape)
+    memory = Memory(limit=int(1e6), action_shape=env.action_space.shape, observation_shape=env.observation_space.shape,
+        storage_dir=memory_dir)
     critic = Critic(layer_norm=layer_norm)
     actor = Actor(nb_actions, layer_norm=layer_norm)
 
@@ -63,7 +77,8 @@ def run(env_id, seed, noise_type, layer_norm, evaluation, **kwargs):
     logger.info('rank {}: seed={}, logdir={}'.format(rank, seed, logger.get_dir()))
     tf.reset_default_graph()
     set_global_seeds(seed)
-    env.seed(seed)
+    if num_envs == 1:
+        env.seed(seed)
     if eval_env is not None:
         eval_env.seed(seed)
 
@@ -102,6 +117,8 @@ def parse_args():
     parser.add_argument('--nb-train-steps', type=int, default=50)  # per epoch cycle and MPI worker
     parser.add_argument('--nb-eval-steps', type=int, default=100)  # per epoch cycle and MPI worker
     parser.add_argument('--nb-rollout-steps', type=int, default=100)  # per epoch cycle and MPI worker
+    parser.add_argument('--num-envs', type=int, default=1)  # envs stepped together per MPI worker
+    parser.add_argument('--memory-dir', type=str, default=None)  # memory-map the replay memory from files in this directory
     parser.add_argument('--noise-type', type=str, default='adaptive-param_0.2')  # choices are adaptive-param_xx, ou_xx, normal_xx, none
     parser.add_argument('--num-timesteps', type=int, default=None)
     boolean_flag(parser, 'evaluation', default=False)
@@ -109,7 +126,7 @@ def parse_args():
     # we don't directly specify timesteps for this script, so make sure that if we do specify them
     # they agree with the other parameters
     if args.num_timesteps is not None:
-        assert(args.num_timesteps == args.nb_epochs * args.nb_epoch_cycles * args.nb_rollout_steps)
+        assert(args.num_timesteps == args.nb_epochs * args.nb_epoch_cycles * args.nb_rollout_steps * args.num_envs)
     dict_args = vars(args)
     del dict_args['num_timesteps']
     return dict_args
@@ -1,12 +1,18 @@
+import os
+
 import numpy as np
 
+from baselines.common import array_storage
+
 
 class RingBuffer(object):
-    def __init__(self, maxlen, shape, dtype='float32'):
+    def __init__(self, maxlen, shape, dtype='float32', storage_dir=None):
         self.maxlen = maxlen
         self.start = 0
         self.length = 0
-        self.data = np.zeros((maxlen,) + shape).astype(dtype)
+        self.storage_dir = storage_dir
+        # memory-mapped from a file in storage_dir if given, see array_storage.zeros
+        self.data = array_storage.zeros((maxlen,) + shape, dtype, storage_dir, 'ring_buffer')
 
     def __len__(self):
         return self.length
@@ -17,7 +23,7 @@ class RingBuffer(object):
         return self.data[(self.start + idx) % self.maxlen]
 
     def get_batch(self, idxs):
-        return self.data[(self.start + idxs) % self.maxlen]
+        return array_storage.take(self.data, (self.start + idxs) % self.maxlen)
 
     def append(self, v):
         if self.length < self.maxlen:
@@ -31,6 +37,34 @@ class RingBuffer(object):
             raise RuntimeError()
         self.data[(self.start + self.length - 1) % self.maxlen] = v
 
+    def extend(self, vs):
+        """Append every entry of vs (along the first axis) in order."""
+        if len(vs) > self.maxlen:
+            # Only the newest maxlen entries would survive anyway.
+            vs = vs[-self.maxlen:]
+        n = len(vs)
+        idxs = (self.start + self.length + np.arange(n)) % self.maxlen
+        self.data[idxs] = vs
+        overflow = max(self.length + n - self.maxlen, 0)
+        self.length = min(self.length + n, self.maxlen)
+        self.start = (self.start + overflow) % self.maxlen
+
+    def save(self, path):
+        """Write the contents to the directory path, streaming the data in chunks."""
+        os.makedirs(path, exist_ok=True)
+        # until the buffer is full, start is 0 and the entries are data[:length]
+        array_storage.save(os.path.join(path, 'data.npy'), self.data[:self.length])
+        array_storage.save_state(os.path.join(path, 'state.pkl'), {'start': self.start, 'length': self.length})
+
+    def load(self, path):
+        """Replace the contents by a snapshot written by save, memory-mapped if possible."""
+        state = array_storage.load_state(os.path.join(path, 'state.pkl'))
+        data = array_storage.load(os.path.join(path, 'data.npy'), self.maxlen, self.storage_dir, 'ring_buffer')
+        assert data.shape == self.data.shape and data.dtype == self.data.dtype
+        self.data = data
+        self.start = state['start']
+        self.length = state['length']
+
 
 def array_min2d(x):
     x = np.array(x)
@@ -40,44 +74,55 @@ def array_min2d(x):
 
 
 class Memory(object):
-    def __init__(self, limit, action_shape, observation_shape):
+    def __init__(self, limit, action_shape, observation_shape, storage_dir=None):
         self.limit = limit
 
-        self.observations0 = RingBuffer(limit, shape=observation_shape)
-        self.actions = RingBuffer(limit, shape=action_shape)
-        self.rewards = RingBuffer(limit, shape=(1,))
-        self.terminals1 = RingBuffer(limit, shape=(1,))
-        self.observations1 = RingBuffer(limit, shape=observation_shape)
+        # All fields of a transition are stored next to each other in a single
+        # record, so appending and sampling touch one array with one index array.
+        self.dtype = np.dtype([
+            ('obs0', 'float32', tuple(observation_shape)),
+            ('actions', 'float32', tuple(action_shape)),
+            ('rewards', 'float32', (1,)),
+            ('terminals1', 'float32', (1,)),
+            ('obs1', 'float32', tuple(observation_shape)),
+        ])
+        self.transitions = RingBuffer(limit, shape=(), dtype=self.dtype, storage_dir=storage_dir)
 
     def sample(self, batch_size):
         # Draw such that we always have a proceeding element.
-        batch_idxs = np.random.random_integers(self.nb_entries - 2, size=batch_size)
-
-        obs0_batch = self.observations0.get_batch(batch_idxs)
-        obs1_batch = self.observations1.get_batch(batch_idxs)
-        action_batch = self.actions.get_batch(batch_idxs)
-        reward_batch = self.rewards.get_batch(batch_idxs)
-        terminal1_batch = self.terminals1.get_batch(batch_idxs)
-
-        result = {
-            'obs0': array_min2d(obs0_batch),
-            'obs1': array_min2d(obs1_batch),
-            'rewards': array_min2d(reward_batch),
-            'actions': array_min2d(action_batch),
-            'terminals1': array_min2d(terminal1_batch),
-        }
+        batch_idxs = np.random.randint(1, self.nb_entries - 1, size=batch_size)
+
+        batch = self.transitions.get_batch(batch_idxs)
+
+        result = {name: array_min2d(batch[name]) for name in self.dtype.names}
         return result
 
     def append(self, obs0, action, reward, obs1, terminal1, training=True):
         if not training:
             return
-        
-        self.observations0.append(obs0)
-        self.actions.append(action)
-        self.rewards.append(reward)
-        self.observations1.append(obs1)
-        self.terminals1.append(terminal1)
+
+        self.transitions.append((obs0, action, reward, terminal1, obs1))
+
+    def extend(self, obs0, actions, rewards, obs1, terminals1, training=True):
+        """Append a batch of transitions, e.g. one step of a vectorized env.
+        Every argument has the batch size as its first dimension."""
+        if not training:
+            return
+
+        records = np.empty(len(obs0), dtype=self.dtype)
+        records['obs0'] = obs0
+        records['actions'] = actions
+        records['rewards'] = np.reshape(rewards, (-1, 1))
+        records['terminals1'] = np.reshape(terminals1, (-1, 1))
+        records['obs1'] = obs1
+        self.transitions.extend(records)
+
+    def save(self, path):
+        self.transitions.save(path)
+
+    def load(self, path):
+        self.transitions.load(path)
 
     @property
     def nb_entries(self):
-        return len(self.observations0)
+        return len(self.transitions)
@@ -29,7 +29,7 @@ class AdaptiveParamNoiseSpec(object):
 
 
 class ActionNoise(object):
-    def reset(self):
+    def reset(self, idxs=None):
         pass
 
 
@@ -60,8 +60,14 @@ class OrnsteinUhlenbeckActionNoise(ActionNoise):
         self.x_prev = x
         return x
 
-    def reset(self):
-        self.x_prev = self.x0 if self.x0 is not None else np.zeros_like(self.mu)
+    def reset(self, idxs=None):
+        x0 = self.x0 if self.x0 is not None else np.zeros_like(self.mu)
+        if idxs is None:
+            self.x_prev = x0
+        else:
+            # Only reset the given rows of a batched (one row per env) process.
+            self.x_prev = np.array(self.x_prev)
+            self.x_prev[idxs] = x0[idxs]
 
     def __repr__(self):
         return 'OrnsteinUhlenbeckActionNoise(mu={}, sigma={})'.format(self.mu, self.sigma)
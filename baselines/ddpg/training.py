@@ -5,6 +5,7 @@ import pickle
 
 from baselines.ddpg.ddpg import DDPG
 import baselines.common.tf_util as U
+from baselines.common.vec_env import VecEnv
 
 from baselines import logger
 import numpy as np
@@ -17,6 +18,10 @@ def train(env, nb_epochs, nb_epoch_cycles, render_eval, reward_scale, render, pa
     popart, gamma, clip_norm, nb_train_steps, nb_rollout_steps, nb_eval_steps, batch_size, memory,
     tau=0.01, eval_env=None, param_noise_adaption_interval=50):
     rank = MPI.COMM_WORLD.Get_rank()
+    # With a VecEnv all envs are stepped together: actions come from one batched
+    # policy evaluation and transitions go to the memory in bulk.
+    vectorized = isinstance(env, VecEnv)
+    nenvs = env.num_envs if vectorized else 1
 
     assert (np.abs(env.action_space.low) == env.action_space.high).all()  # we assume symmetric actions.
     max_action = env.action_space.high
@@ -49,8 +54,8 @@ def train(env, nb_epochs, nb_epoch_cycles, render_eval, reward_scale, render, pa
         if eval_env is not None:
             eval_obs = eval_env.reset()
         done = False
-        episode_reward = 0.
-        episode_step = 0
+        episode_reward = np.zeros(nenvs)
+        episode_step = np.zeros(nenvs, dtype=int)
         episodes = 0
         t = 0
 
@@ -68,17 +73,22 @@ def train(env, nb_epochs, nb_epoch_cycles, render_eval, reward_scale, render, pa
         for epoch in range(nb_epochs):
             for cycle in range(nb_epoch_cycles):
                 # Perform rollouts.
+                cycle_episodes = 0
                 for t_rollout in range(nb_rollout_steps):
                     # Predict next action.
-                    action, q = agent.pi(obs, apply_noise=True, compute_Q=True)
-                    assert action.shape == env.action_space.shape
+                    if vectorized:
+                        action, q = agent.pi_batch(obs, apply_noise=True, compute_Q=True)
+                        assert action.shape == (nenvs,) + env.action_space.shape
+                    else:
+                        action, q = agent.pi(obs, apply_noise=True, compute_Q=True)
+                        assert action.shape == env.action_space.shape
 
                     # Execute next action.
                     if rank == 0 and render:
                         env.render()
-                    assert max_action.shape == action.shape
+                    assert max_action.shape == env.action_space.shape
                     new_obs, r, done, info = env.step(max_action * action)  # scale for execution in env (as far as DDPG is concerned, every action is in [-1, 1])
-                    t += 1
+                    t += nenvs
                     if rank == 0 and render:
                         env.render()
                     episode_reward += r
@@ -87,21 +97,36 @@ def train(env, nb_epochs, nb_epoch_cycles, render_eval, reward_scale, render, pa
                     # Book-keeping.
                     epoch_actions.append(action)
                     epoch_qs.append(q)
-                    agent.store_transition(obs, action, r, new_obs, done)
+                    if vectorized:
+                        agent.store_transitions(obs, action, r, new_obs, done)
+                    else:
+                        agent.store_transition(obs, action, r, new_obs, done)
                     obs = new_obs
 
-                    if done:
+                    done_idxs = np.flatnonzero(done)
+                    for d in done_idxs:
                         # Episode done.
-                        epoch_episode_rewards.append(episode_reward)
-                        episode_rewards_history.append(episode_reward)
-                        epoch_episode_steps.append(episode_step)
-                        episode_reward = 0.
-                        episode_step = 0
+                        epoch_episode_rewards.append(episode_reward[d])
+                        episode_rewards_history.append(episode_reward[d])
+                        epoch_episode_steps.append(episode_step[d])
+                        episode_reward[d] = 0.
+                        episode_step[d] = 0
                         epoch_episodes += 1
                         episodes += 1
-
-                        agent.reset()
-                        obs = env.reset()
+                        cycle_episodes += 1
+
+                    if len(done_idxs) > 0:
+                        if vectorized:
+                            # The VecEnv already reset the finished envs.
+                            agent.reset(done_idxs)
+                        else:
+                            agent.reset()
+                            obs = env.reset()
+
+                if vectorized and cycle_episodes > 0:
+                    # With a VecEnv, resample the parameter noise once per cycle in which
+                    # episodes ended rather than at every env's episode end.
+                    agent.perturb_policy()
 
                 # Train.
                 epoch_actor_losses = []
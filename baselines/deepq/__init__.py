@@ -1,7 +1,7 @@
 from baselines.deepq import models  # noqa
-from baselines.deepq.build_graph import build_act, build_train  # noqa
+from baselines.deepq.build_graph import build_act, build_act_with_param_noise, build_copy_q_func, build_train  # noqa
 from baselines.deepq.simple import learn, load  # noqa
-from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer  # noqa
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, FrameStackReplayBuffer  # noqa
 
 def wrap_atari_dqn(env):
     from baselines.common.atari_wrappers import wrap_deepmind
@@ -314,6 +314,34 @@ def build_act_with_param_noise(make_obs_ph, q_func, num_actions, scope="deepq",
         return act
 
 
+def build_copy_q_func(source_scope, dest_scope):
+    """Creates a function that copies the parameters of the Q network of the act function
+    built in `source_scope` to the one built in `dest_scope`. Used to publish the weights of
+    the learner to a separate act function of an actor.
+
+    Parameters
+    ----------
+    source_scope: str
+        scope the source act function was built in, e.g. "deepq"
+    dest_scope: str
+        scope the destination act function was built in
+
+    Returns
+    -------
+    copy: () -> ()
+        copies the parameters when called.
+    """
+    source_vars = scope_vars(source_scope + "/q_func/", trainable_only=True)
+    dest_vars = scope_vars(dest_scope + "/q_func/", trainable_only=True)
+    assert len(source_vars) == len(dest_vars) > 0
+    copy_expr = []
+    for var, var_dest in zip(sorted(source_vars, key=lambda v: v.name),
+                             sorted(dest_vars, key=lambda v: v.name)):
+        copy_expr.append(var_dest.assign(var))
+    copy_expr = tf.group(*copy_expr)
+    return U.function([], [], updates=[copy_expr])
+
+
 def build_train(make_obs_ph, q_func, num_actions, optimizer, grad_norm_clipping=None, gamma=1.0,
     double_q=True, scope="deepq", reuse=None, param_noise=False, param_noise_filter_func=None):
     """Creates the train function:
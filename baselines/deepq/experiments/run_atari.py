@@ -4,6 +4,8 @@ from baselines import bench
 import argparse
 from baselines import logger
 from baselines.common.atari_wrappers import make_atari
+from baselines.common.vec_env.subproc_vec_env import SubprocVecEnv
+import os
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -12,12 +14,25 @@ def main():
     parser.add_argument('--prioritized', type=int, default=1)
     parser.add_argument('--dueling', type=int, default=1)
     parser.add_argument('--num-timesteps', type=int, default=int(10e6))
+    parser.add_argument('--num-envs', help='number of environments stepped together', type=int, default=1)
+    parser.add_argument('--frame-stack-replay', help='store every frame only once in the replay buffer '
+                        '(not with --prioritized)', type=int, default=0)
     args = parser.parse_args()
     logger.configure()
     set_global_seeds(args.seed)
-    env = make_atari(args.env)
-    env = bench.Monitor(env, logger.get_dir())
-    env = deepq.wrap_atari_dqn(env)
+    if args.num_envs > 1:
+        def make_env(rank):
+            def _thunk():
+                env = make_atari(args.env)
+                env.seed(args.seed + rank)
+                env = bench.Monitor(env, logger.get_dir() and os.path.join(logger.get_dir(), str(rank)))
+                return deepq.wrap_atari_dqn(env)
+            return _thunk
+        env = SubprocVecEnv([make_env(i) for i in range(args.num_envs)])
+    else:
+        env = make_atari(args.env)
+        env = bench.Monitor(env, logger.get_dir())
+        env = deepq.wrap_atari_dqn(env)
     model = deepq.models.cnn_to_mlp(
         convs=[(32, 8, 4), (64, 4, 2), (64, 3, 1)],
         hiddens=[256],
@@ -35,7 +50,9 @@ def main():
         learning_starts=10000,
         target_network_update_freq=1000,
         gamma=0.99,
-        prioritized_replay=bool(args.prioritized)
+        prioritized_replay=bool(args.prioritized),
+        # wrap_atari_dqn stacks 4 frames
+        replay_frame_stack=4 if args.frame_stack_replay else None
     )
     # act.save("pong_model.pkl") XXX
     env.close()
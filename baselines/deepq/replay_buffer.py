@@ -1,11 +1,14 @@
+import os
+
 import numpy as np
 import random
 
+from baselines.common import array_storage
 from baselines.common.segment_tree import SumSegmentTree, MinSegmentTree
 
 
 class ReplayBuffer(object):
-    def __init__(self, size):
+    def __init__(self, size, preallocate=False, storage_dir=None):
         """Create Replay buffer.
 
         Parameters
@@ -13,24 +16,87 @@ class ReplayBuffer(object):
         size: int
             Max number of transitions to store in the buffer. When the buffer
             overflows the old memories are dropped.
+        preallocate: bool
+            if True, transitions are stored column-wise in typed numpy arrays
+            of length `size` that are allocated on the first call to `add`
+            (shapes and dtypes are taken from that first transition), and
+            sampling is a single fancy-indexing gather per column.
+            Otherwise each transition is kept as a tuple in a python list.
+        storage_dir: str or None
+            if given, the preallocated arrays are memory-mapped files in
+            this directory instead of living in memory, see
+            baselines.common.array_storage.zeros. Implies preallocate.
         """
         self._storage = []
         self._maxsize = size
         self._next_idx = 0
+        self._num_stored = 0
+        self._preallocate = preallocate or storage_dir is not None
+        self._storage_dir = storage_dir
+
+    def _zeros(self, shape, dtype, name):
+        return array_storage.zeros((self._maxsize,) + tuple(shape), dtype, self._storage_dir, name)
 
     def __len__(self):
-        return len(self._storage)
+        return self._num_stored
+
+    def _allocate_storage(self, obs_t, action):
+        obs_t = np.asarray(obs_t)
+        action = np.asarray(action)
+        self._storage = [
+            self._zeros(obs_t.shape, obs_t.dtype, 'obs_t'),
+            self._zeros(action.shape, action.dtype, 'action'),
+            self._zeros((), np.float32, 'reward'),
+            self._zeros(obs_t.shape, obs_t.dtype, 'obs_tp1'),
+            self._zeros((), np.float32, 'done'),
+        ]
 
     def add(self, obs_t, action, reward, obs_tp1, done):
         data = (obs_t, action, reward, obs_tp1, done)
 
-        if self._next_idx >= len(self._storage):
+        if self._preallocate:
+            if self._num_stored == 0:
+                self._allocate_storage(obs_t, action)
+            for column, value in zip(self._storage, data):
+                column[self._next_idx] = value
+        elif self._next_idx >= len(self._storage):
             self._storage.append(data)
         else:
             self._storage[self._next_idx] = data
         self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._num_stored = min(self._num_stored + 1, self._maxsize)
+
+    def extend(self, obs_t, action, reward, obs_tp1, done):
+        """Add a batch of transitions, e.g. one step of a vectorized
+        environment. Every argument has the batch size as its first
+        dimension. With preallocated storage this is one scatter per
+        column, otherwise the transitions are added one by one.
+        """
+        if not self._preallocate:
+            for data in zip(obs_t, action, reward, obs_tp1, done):
+                self.add(*data)
+            return
+        data = [np.asarray(value) for value in (obs_t, action, reward, obs_tp1, done)]
+        n = len(data[0])
+        if n == 0:
+            return
+        if self._num_stored == 0:
+            self._allocate_storage(data[0][0], data[1][0])
+        # only the newest transitions would survive anyway, stored where add would put them
+        idxes = self._extend_idxes(n)
+        for column, value in zip(self._storage, data):
+            column[idxes] = value[-len(idxes):]
+        self._next_idx = (self._next_idx + n) % self._maxsize
+        self._num_stored = min(self._num_stored + n, self._maxsize)
+
+    def _extend_idxes(self, n):
+        # where the newest min(n, size) of n transitions added from _next_idx on end up
+        kept = min(n, self._maxsize)
+        return (self._next_idx + n - kept + np.arange(kept)) % self._maxsize
 
     def _encode_sample(self, idxes):
+        if self._preallocate:
+            return tuple(array_storage.take(column, idxes) for column in self._storage)
         obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
         for i in idxes:
             data = self._storage[i]
@@ -64,12 +130,92 @@ class ReplayBuffer(object):
             done_mask[i] = 1 if executing act_batch[i] resulted in
             the end of an episode and 0 otherwise.
         """
-        idxes = [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
+        if self._preallocate:
+            idxes = np.random.randint(0, len(self), size=batch_size)
+        else:
+            idxes = [random.randint(0, len(self) - 1) for _ in range(batch_size)]
         return self._encode_sample(idxes)
 
+    _column_names = ('obs_t', 'action', 'reward', 'obs_tp1', 'done')
+
+    def _snapshot_arrays(self):
+        # arrays whose first len(self) rows hold the stored transitions
+        return dict(zip(self._column_names, self._storage))
+
+    def _restore_arrays(self, arrays):
+        self._storage = [arrays[name] for name in self._column_names]
+        self._preallocate = True
+
+    def _snapshot_rows(self):
+        # number of leading rows of the arrays that have to be saved
+        return len(self)
+
+    def _snapshot_state(self):
+        return {'next_idx': self._next_idx, 'num_stored': self._num_stored}
+
+    def _restore_state(self, state):
+        self._next_idx = state['next_idx']
+        self._num_stored = state['num_stored']
+
+    def _list_columns(self):
+        # the python list storage as (name, shape, dtype, chunks) columns
+        rows = array_storage.CHUNK_BYTES // max(np.asarray(self._storage[0][0]).nbytes, 1) + 1
+        for j, name in enumerate(self._column_names):
+            first = np.asarray(self._storage[0][j], dtype=np.float32 if name in ('reward', 'done') else None)
+            chunks = ([data[j] for data in self._storage[i:i + rows]] for i in range(0, len(self), rows))
+            yield name, (len(self),) + first.shape, first.dtype, chunks
+
+    def save(self, path):
+        """Save the contents of the buffer to the directory `path`.
+
+        Every array is streamed to its own .npy file in chunks, so no
+        full copy of the buffer is made in memory.
+
+        Parameters
+        ----------
+        path: str
+            directory to write to, created if it does not exist
+        """
+        os.makedirs(path, exist_ok=True)
+        names = []
+        if not self._preallocate and len(self) > 0:
+            for name, shape, dtype, chunks in self._list_columns():
+                array_storage.write_npy(os.path.join(path, name + '.npy'), chunks, shape, dtype)
+                names.append(name)
+        elif len(self) > 0:
+            rows = self._snapshot_rows()
+            for name, array in self._snapshot_arrays().items():
+                array_storage.save(os.path.join(path, name + '.npy'), array[:rows])
+                names.append(name)
+        state = self._snapshot_state()
+        state['arrays'] = names
+        array_storage.save_state(os.path.join(path, 'state.pkl'), state)
+
+    def load(self, path):
+        """Replace the contents of the buffer by a snapshot written by `save`.
+
+        The buffer must have the same size as the one that was saved.
+        A full snapshot is memory-mapped (copy-on-write) rather than read,
+        unless the buffer has a storage_dir, into which it is then copied.
+        Afterwards the buffer is always preallocated.
+
+        Parameters
+        ----------
+        path: str
+            directory written by `save`
+        """
+        state = array_storage.load_state(os.path.join(path, 'state.pkl'))
+        if state['arrays']:
+            self._restore_arrays({name: array_storage.load(os.path.join(path, name + '.npy'), self._maxsize,
+                                                           self._storage_dir, name)
+                                  for name in state['arrays']})
+        else:
+            self._storage = []
+        self._restore_state(state)
+
 
 class PrioritizedReplayBuffer(ReplayBuffer):
-    def __init__(self, size, alpha):
+    def __init__(self, size, alpha, preallocate=False, storage_dir=None):
         """Create Prioritized Replay buffer.
 
         Parameters
@@ -80,12 +226,16 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         alpha: float
             how much prioritization is used
             (0 - no prioritization, 1 - full prioritization)
+        preallocate: bool
+            see ReplayBuffer.__init__
+        storage_dir: str or None
+            see ReplayBuffer.__init__
 
         See Also
         --------
         ReplayBuffer.__init__
         """
-        super(PrioritizedReplayBuffer, self).__init__(size)
+        super(PrioritizedReplayBuffer, self).__init__(size, preallocate=preallocate, storage_dir=storage_dir)
         assert alpha > 0
         self._alpha = alpha
 
@@ -104,16 +254,27 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         self._it_sum[idx] = self._max_priority ** self._alpha
         self._it_min[idx] = self._max_priority ** self._alpha
 
-    def _sample_proportional(self, batch_size):
-        res = []
-        for _ in range(batch_size):
-            # TODO(szymon): should we ensure no repeats?
-            mass = random.random() * self._it_sum.sum(0, len(self._storage) - 1)
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
+    def extend(self, obs_t, action, reward, obs_tp1, done):
+        """See ReplayBuffer.extend"""
+        idxes = self._extend_idxes(len(obs_t))
+        super().extend(obs_t, action, reward, obs_tp1, done)
+        self._it_sum[idxes] = self._max_priority ** self._alpha
+        self._it_min[idxes] = self._max_priority ** self._alpha
+
+    def _sample_proportional(self, batch_size, stratified=False):
+        # TODO(szymon): should we ensure no repeats?
+        # leaves past len(self) are zero, so the total mass is read off the root
+        total = self._it_sum.sum()
+        if stratified:
+            # one draw from each of batch_size equal-mass segments
+            masses = (np.arange(batch_size) + np.random.random(batch_size)) * (total / batch_size)
+        else:
+            masses = np.random.random(batch_size) * total
+        idxes = self._it_sum.find_prefixsum_idx(masses)
+        # guard against rounding pushing the descent into the empty tail
+        return np.minimum(idxes, len(self) - 1)
 
-    def sample(self, batch_size, beta):
+    def sample(self, batch_size, beta, stratified=False):
         """Sample a batch of experiences.
 
         compared to ReplayBuffer.sample
@@ -128,6 +289,10 @@ class PrioritizedReplayBuffer(ReplayBuffer):
         beta: float
             To what degree to use importance weights
             (0 - no corrections, 1 - full correction)
+        stratified: bool
+            if True the total priority mass is split into batch_size
+            equal segments and one transition is drawn from each of them,
+            otherwise all transitions are drawn independently.
 
         Returns
         -------
@@ -146,22 +311,18 @@ class PrioritizedReplayBuffer(ReplayBuffer):
             Array of shape (batch_size,) and dtype np.float32
             denoting importance weight of each sampled transition
         idxes: np.array
-            Array of shape (batch_size,) and dtype np.int32
+            Array of shape (batch_size,) and dtype np.int64
             idexes in buffer of sampled experiences
         """
         assert beta > 0
 
-        idxes = self._sample_proportional(batch_size)
+        idxes = self._sample_proportional(batch_size, stratified=stratified)
 
-        weights = []
-        p_min = self._it_min.min() / self._it_sum.sum()
-        max_weight = (p_min * len(self._storage)) ** (-beta)
-
-        for idx in idxes:
-            p_sample = self._it_sum[idx] / self._it_sum.sum()
-            weight = (p_sample * len(self._storage)) ** (-beta)
-            weights.append(weight / max_weight)
-        weights = np.array(weights)
+        total = self._it_sum.sum()
+        p_min = self._it_min.min() / total
+        max_weight = (p_min * len(self)) ** (-beta)
+        p_sample = self._it_sum[idxes] / total
+        weights = ((p_sample * len(self)) ** (-beta) / max_weight).astype(np.float32)
         encoded_sample = self._encode_sample(idxes)
         return tuple(list(encoded_sample) + [weights, idxes])
 
@@ -173,18 +334,229 @@ class PrioritizedReplayBuffer(ReplayBuffer):
 
         Parameters
         ----------
-        idxes: [int]
+        idxes: [int] or np.array
             List of idxes of sampled transitions
-        priorities: [float]
+        priorities: [float] or np.array
             List of updated priorities corresponding to
             transitions at the sampled idxes denoted by
             variable `idxes`.
         """
-        assert len(idxes) == len(priorities)
-        for idx, priority in zip(idxes, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
-
-            self._max_priority = max(self._max_priority, priority)
+        idxes = np.asarray(idxes, dtype=np.int64)
+        priorities = np.asarray(priorities, dtype=np.float64)
+        assert idxes.shape == priorities.shape
+        if idxes.size == 0:
+            return
+        assert np.all(priorities > 0)
+        assert np.all(0 <= idxes) and np.all(idxes < len(self))
+        self._it_sum[idxes] = priorities ** self._alpha
+        self._it_min[idxes] = priorities ** self._alpha
+
+        self._max_priority = max(self._max_priority, priorities.max())
+
+    def _snapshot_state(self):
+        state = super(PrioritizedReplayBuffer, self)._snapshot_state()
+        state['max_priority'] = self._max_priority
+        return state
+
+    def _restore_state(self, state):
+        super(PrioritizedReplayBuffer, self)._restore_state(state)
+        self._max_priority = state['max_priority']
+
+    def save(self, path):
+        """See ReplayBuffer.save, the priorities are saved as well."""
+        super(PrioritizedReplayBuffer, self).save(path)
+        array_storage.save(os.path.join(path, 'it_sum.npy'), self._it_sum._value)
+        array_storage.save(os.path.join(path, 'it_min.npy'), self._it_min._value)
+
+    def load(self, path):
+        """See ReplayBuffer.load, the priorities are restored as well."""
+        super(PrioritizedReplayBuffer, self).load(path)
+        for name, tree in (('it_sum', self._it_sum), ('it_min', self._it_min)):
+            value = np.load(os.path.join(path, name + '.npy'))
+            assert value.shape == tree._value.shape, "snapshot was saved from a buffer of a different size"
+            tree._value[...] = value
+
+
+class FrameStackReplayBuffer(ReplayBuffer):
+    def __init__(self, size, frame_stack=4, storage_dir=None, num_streams=1):
+        """Create Replay buffer for stacked frame observations which
+        stores every frame only once.
+
+        Observations passed to `add` must be the `frame_stack` most recent
+        frames concatenated along the last axis (like the ones returned by
+        baselines.common.atari_wrappers.FrameStack) and consecutive calls to
+        `add` must belong to the same episode until `done` is set.
+        Only the newest frame of obs_tp1 is written to a circular frame
+        array, preceded by the frames of obs_t on the first transition of
+        every episode. Stacked observations are rebuilt from contiguous
+        windows of that array in `sample`.
+
+        The frame array is split into `num_streams` circular segments of
+        size // num_streams frames, one per environment of a vectorized
+        environment, so that the frames of every environment stay
+        contiguous when `extend` adds one transition of each.
+
+        Parameters
+        ----------
+        size: int
+            Max number of frames to store in the buffer. Every transition
+            takes one frame and every episode `frame_stack` extra frames.
+            When the buffer overflows the old memories are dropped.
+        frame_stack: int
+            number of frames stacked in a single observation
+        storage_dir: str or None
+            see ReplayBuffer.__init__
+        num_streams: int
+            number of environments whose transitions are added together by
+            `extend`. `add` adds to the first one.
+
+        See Also
+        --------
+        ReplayBuffer.__init__
+        """
+        stream_size = size // num_streams
+        super(FrameStackReplayBuffer, self).__init__(stream_size * num_streams, preallocate=True,
+                                                     storage_dir=storage_dir)
+        assert stream_size > frame_stack
+        self._frame_stack = frame_stack
+        self._num_streams = num_streams
+        self._stream_size = stream_size
+        # next frame and number of frames of every stream, within its segment
+        self._stream_next = np.zeros(num_streams, dtype=np.int64)
+        self._stream_stored = np.zeros(num_streams, dtype=np.int64)
+        self._is_transition = np.zeros(self._maxsize, dtype=np.bool_)
+        self._episode_start = np.ones(num_streams, dtype=np.bool_)
+
+    def _allocate_storage(self, obs_t, action):
+        obs_t = np.asarray(obs_t)
+        action = np.asarray(action)
+        assert obs_t.shape[-1] % self._frame_stack == 0
+        self._frame_channels = obs_t.shape[-1] // self._frame_stack
+        frame_shape = obs_t.shape[:-1] + (self._frame_channels,)
+        self._frames = self._zeros(frame_shape, obs_t.dtype, 'frames')
+        self._actions = self._zeros(action.shape, action.dtype, 'action')
+        self._rewards = self._zeros((), np.float32, 'reward')
+        self._dones = self._zeros((), np.float32, 'done')
+
+    def _add_frame(self, stream, frame, transition=None):
+        idx = stream * self._stream_size + self._stream_next[stream]
+        self._frames[idx] = frame
+        if transition is None:
+            self._is_transition[idx] = False
+        else:
+            self._is_transition[idx] = True
+            self._actions[idx], self._rewards[idx], self._dones[idx] = transition
+        self._stream_next[stream] = (self._stream_next[stream] + 1) % self._stream_size
+        if self._stream_stored[stream] < self._stream_size:
+            self._stream_stored[stream] += 1
+            self._num_stored += 1
+
+    def _add_to_stream(self, stream, obs_t, action, reward, obs_tp1, done):
+        c = self._frame_channels
+        if self._episode_start[stream]:
+            obs_t = np.asarray(obs_t)
+            for i in range(self._frame_stack):
+                self._add_frame(stream, obs_t[..., i * c:(i + 1) * c])
+        self._add_frame(stream, np.asarray(obs_tp1)[..., -c:], (action, reward, done))
+        self._episode_start[stream] = bool(done)
+
+    def add(self, obs_t, action, reward, obs_tp1, done):
+        if self._num_stored == 0:
+            self._allocate_storage(obs_t, action)
+        self._add_to_stream(0, obs_t, action, reward, obs_tp1, done)
+
+    def extend(self, obs_t, action, reward, obs_tp1, done):
+        """Add one transition to every stream, e.g. one step of a
+        vectorized environment. Every argument has `num_streams` as its
+        first dimension.
+        """
+        assert len(obs_t) == self._num_streams
+        if self._num_stored == 0:
+            self._allocate_storage(obs_t[0], action[0])
+        for stream, data in enumerate(zip(obs_t, action, reward, obs_tp1, done)):
+            self._add_to_stream(stream, *data)
+
+    def _split(self, idxes):
+        # stream of every index and its position within the stream's segment
+        return np.divmod(np.asarray(idxes), self._stream_size)
+
+    def _is_valid(self, idxes):
+        # a transition stored at idx needs the frames idx - frame_stack ... idx
+        # of its stream, none of which may have been overwritten since
+        stream, pos = self._split(idxes)
+        full = self._stream_stored[stream] == self._stream_size
+        oldest = np.where(full, self._stream_next[stream], 0)
+        return self._is_transition[idxes] & ((pos - oldest) % self._stream_size >= self._frame_stack)
+
+    def _stack_frames(self, frames):
+        # (batch, frame_stack, ..., c) -> (batch, ..., frame_stack * c)
+        frames = np.moveaxis(frames, 1, -2)
+        return frames.reshape(frames.shape[:-2] + (-1,))
+
+    def _encode_sample(self, idxes):
+        idxes = np.asarray(idxes)
+        stream, pos = self._split(idxes)
+        window = (stream[:, None] * self._stream_size +
+                  (pos[:, None] + np.arange(-self._frame_stack, 1)) % self._stream_size)
+        frames = array_storage.take(self._frames, window.ravel()).reshape(window.shape + self._frames.shape[1:])
+        obses_t = self._stack_frames(frames[:, :-1])
+        obses_tp1 = self._stack_frames(frames[:, 1:])
+        return (obses_t, array_storage.take(self._actions, idxes), array_storage.take(self._rewards, idxes),
+                obses_tp1, array_storage.take(self._dones, idxes))
+
+    def _sample_idxes(self, batch_size):
+        # uniform over the stored frames, every stream filling its segment from the start
+        n = np.random.randint(0, len(self), size=batch_size)
+        ends = np.cumsum(self._stream_stored)
+        stream = np.searchsorted(ends, n, side='right')
+        return stream * self._stream_size + n - (ends - self._stream_stored)[stream]
+
+    def sample(self, batch_size):
+        """Sample a batch of experiences.
+
+        See ReplayBuffer.sample
+        """
+        assert len(self) > 0
+        idxes = self._sample_idxes(batch_size)
+        invalid = ~self._is_valid(idxes)
+        while invalid.any():
+            idxes[invalid] = self._sample_idxes(invalid.sum())
+            invalid = ~self._is_valid(idxes)
+        return self._encode_sample(idxes)
+
+    _column_names = ('frames', 'action', 'reward', 'done', 'is_transition')
+
+    def _snapshot_rows(self):
+        used = np.flatnonzero(self._stream_stored)
+        return 0 if len(used) == 0 else used[-1] * self._stream_size + self._stream_stored[used[-1]]
+
+    def _snapshot_arrays(self):
+        return {'frames': self._frames, 'action': self._actions, 'reward': self._rewards,
+                'done': self._dones, 'is_transition': self._is_transition}
+
+    def _restore_arrays(self, arrays):
+        self._frames = arrays['frames']
+        self._actions = arrays['action']
+        self._rewards = arrays['reward']
+        self._dones = arrays['done']
+        self._is_transition = np.array(arrays['is_transition'])
+
+    def _snapshot_state(self):
+        state = super(FrameStackReplayBuffer, self)._snapshot_state()
+        state['episode_start'] = self._episode_start.copy()
+        state['stream_next'] = self._stream_next.copy()
+        state['stream_stored'] = self._stream_stored.copy()
+        if self._num_stored > 0:
+            state['frame_channels'] = self._frame_channels
+        return state
+
+    def _restore_state(self, state):
+        super(FrameStackReplayBuffer, self)._restore_state(state)
+        assert len(state['stream_next']) == self._num_streams
+        self._episode_start = state['episode_start'].copy()
+        self._stream_next = state['stream_next'].copy()
+        self._stream_stored = state['stream_stored'].copy()
+        if 'frame_channels' in state:
+            self._frame_channels = state['frame_channels']
+        else:
+            self._is_transition[...] = False
@@ -1,5 +1,6 @@
 import os
 import tempfile
+import threading
 
 import tensorflow as tf
 import zipfile
@@ -10,8 +11,9 @@ import gym
 import baselines.common.tf_util as U
 from baselines import logger
 from baselines.common.schedules import LinearSchedule
+from baselines.common.vec_env import VecEnv
 from baselines import deepq
-from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, FrameStackReplayBuffer
 from baselines.deepq.utils import BatchInput, load_state, save_state
 
 
@@ -82,12 +84,15 @@ def learn(env,
           lr=5e-4,
           max_timesteps=100000,
           buffer_size=50000,
+          buffer_dir=None,
+          replay_frame_stack=None,
           exploration_fraction=0.1,
           exploration_final_eps=0.02,
           train_freq=1,
           batch_size=32,
           print_freq=100,
           checkpoint_freq=10000,
+          checkpoint_path=None,
           learning_starts=1000,
           gamma=1.0,
           target_network_update_freq=500,
@@ -97,13 +102,20 @@ def learn(env,
           prioritized_replay_beta_iters=None,
           prioritized_replay_eps=1e-6,
           param_noise=False,
+          learner_thread=False,
+          replay_ratio=None,
+          publish_freq=50,
+          learner_lag=100,
           callback=None):
     """Train a deepq model.
 
     Parameters
     -------
-    env: gym.Env
-        environment to train on
+    env: gym.Env or VecEnv
+        environment to train on. With a VecEnv all its environments are
+        stepped together, actions are selected for all of them with one
+        call to act and their transitions are added to the replay buffer
+        in one batch. Every step of every environment counts as a timestep.
     q_func: (tf.Variable, int, str, bool) -> tf.Variable
         the model that takes the following inputs:
             observation_in: object
@@ -120,6 +132,14 @@ def learn(env,
         number of env steps to optimizer for
     buffer_size: int
         size of the replay buffer
+    buffer_dir: str
+        if not None, the replay buffer is preallocated and memory-mapped
+        from files in this directory instead of being kept in memory
+    replay_frame_stack: int
+        if not None, observations are stacks of this many frames along the
+        last axis (e.g. from deepq.wrap_atari_dqn) and the replay buffer is
+        a FrameStackReplayBuffer, which stores every frame only once.
+        `buffer_size` then counts frames. Not supported with prioritized_replay.
     exploration_fraction: float
         fraction of entire training period over which the exploration rate is annealed
     exploration_final_eps: float
@@ -136,6 +156,11 @@ def learn(env,
         how often to save the model. This is so that the best version is restored
         at the end of the training. If you do not wish to restore the best version at
         the end of the training set this variable to None.
+    checkpoint_path: str
+        if not None, the checkpoints (the model and the replay buffer) are
+        kept in this directory instead of a temporary one. A checkpoint found
+        there at the start is restored, so that a job that was interrupted
+        resumes with its model and without refilling its replay buffer.
     learning_starts: int
         how many steps of the model to collect transitions for before learning starts
     gamma: float
@@ -153,6 +178,26 @@ def learn(env,
         to 1.0. If set to None equals to max_timesteps.
     prioritized_replay_eps: float
         epsilon to add to the TD errors when updating priorities.
+    param_noise: bool
+        whether or not to use parameter space noise for exploration.
+    learner_thread: bool
+        if True, training runs continuously in a separate thread instead of
+        every `train_freq` steps, while this thread keeps stepping the env.
+        Both share the replay buffer under a lock. The actor selects actions
+        with its own copy of the Q network, to which the learner publishes
+        its weights every `publish_freq` updates.
+    replay_ratio: float
+        only with learner_thread. Target number of transitions sampled for
+        training per env step after `learning_starts`. The learner waits
+        whenever it is ahead of it, the actor whenever the learner trails it
+        by more than `learner_lag` updates. Defaults to batch_size / train_freq,
+        which is the ratio of the inline training.
+    publish_freq: int
+        only with learner_thread. Number of updates between two copies of the
+        learner's weights to the actor.
+    learner_lag: int
+        only with learner_thread. Number of updates the learner may trail
+        `replay_ratio` by before the actor waits for it.
     callback: (locals, globals) -> None
         function called at every steps with state of the algorithm.
         If callback returns true training stops.
@@ -192,16 +237,37 @@ def learn(env,
 
     act = ActWrapper(act, act_params)
 
+    if learner_thread:
+        # the actor acts with its own copy of the Q network
+        build_actor_act = deepq.build_act_with_param_noise if param_noise else deepq.build_act
+        actor_act = build_actor_act(make_obs_ph, q_func, env.action_space.n, scope="deepq_actor")
+        publish_weights = deepq.build_copy_q_func("deepq", "deepq_actor")
+        if replay_ratio is None:
+            replay_ratio = batch_size / train_freq
+    else:
+        actor_act = act
+
+    vectorized = isinstance(env, VecEnv)
+    nenvs = env.num_envs if vectorized else 1
+
     # Create the replay buffer
-    if prioritized_replay:
-        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha)
+    # (preallocated for vectorized envs, so that batches are added with one scatter per column)
+    if replay_frame_stack is not None:
+        assert not prioritized_replay, "replay_frame_stack is not supported with prioritized_replay"
+        # the frames of every env of a VecEnv are kept in their own stream
+        replay_buffer = FrameStackReplayBuffer(buffer_size, frame_stack=replay_frame_stack, storage_dir=buffer_dir,
+                                               num_streams=nenvs)
+        beta_schedule = None
+    elif prioritized_replay:
+        replay_buffer = PrioritizedReplayBuffer(buffer_size, alpha=prioritized_replay_alpha,
+                                                preallocate=vectorized, storage_dir=buffer_dir)
         if prioritized_replay_beta_iters is None:
             prioritized_replay_beta_iters = max_timesteps
         beta_schedule = LinearSchedule(prioritized_replay_beta_iters,
                                        initial_p=prioritized_replay_beta0,
                                        final_p=1.0)
     else:
-        replay_buffer = ReplayBuffer(buffer_size)
+        replay_buffer = ReplayBuffer(buffer_size, preallocate=vectorized, storage_dir=buffer_dir)
         beta_schedule = None
     # Create the schedule for exploration starting from 1.
     exploration = LinearSchedule(schedule_timesteps=int(exploration_fraction * max_timesteps),
@@ -212,84 +278,236 @@ def learn(env,
     U.initialize()
     update_target()
 
+    # the replay buffer is shared with the learner thread, as are the actor's weights
+    buffer_lock = threading.Lock()
+    weights_lock = threading.Lock()
+    if learner_thread:
+        publish_weights()
+
+    def train_step(t):
+        # Minimize the error in Bellman's equation on a batch sampled from replay buffer.
+        with buffer_lock:
+            if prioritized_replay:
+                experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(t))
+                (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
+            else:
+                obses_t, actions, rewards, obses_tp1, dones = replay_buffer.sample(batch_size)
+                weights, batch_idxes = np.ones_like(rewards), None
+        td_errors = train(obses_t, actions, rewards, obses_tp1, dones, weights)
+        if prioritized_replay:
+            new_priorities = np.abs(td_errors) + prioritized_replay_eps
+            with buffer_lock:
+                replay_buffer.update_priorities(batch_idxes, new_priorities)
+
+    # progress shared with the learner thread, guarded by learner_cond
+    learner_cond = threading.Condition()
+    env_steps = 0
+    num_updates = 0
+    learner_stopped = False
+    learner_errors = []
+    # set by the actor while it checkpoints, the learner does not start updates then
+    checkpointing = False
+    # set by the learner from the start of an update until its weights are consistent again
+    learner_busy = False
+
+    def updates_behind():
+        # number of updates the learner is behind replay_ratio
+        return replay_ratio * max(env_steps - learning_starts, 0) / batch_size - num_updates
+
+    def learner_can_train():
+        return env_steps > learning_starts and updates_behind() > 0
+
+    def actor_can_step():
+        return learner_stopped or learner_errors or updates_behind() <= learner_lag
+
+    def run_learner():
+        nonlocal num_updates, learner_busy
+        target_updates = 0
+        try:
+            with sess.as_default():
+                while True:
+                    with learner_cond:
+                        learner_cond.wait_for(lambda: learner_stopped or (not checkpointing and learner_can_train()))
+                        if learner_stopped:
+                            return
+                        steps = env_steps
+                        learner_busy = True
+                    train_step(steps)
+                    if (num_updates + 1) % publish_freq == 0:
+                        with weights_lock:
+                            publish_weights()
+                    if steps // target_network_update_freq > target_updates:
+                        # Update target network every target_network_update_freq env steps.
+                        target_updates = steps // target_network_update_freq
+                        update_target()
+                    with learner_cond:
+                        num_updates += 1
+                        learner_busy = False
+                        learner_cond.notify_all()
+        except Exception as e:
+            # re-raised by the actor
+            with learner_cond:
+                learner_errors.append(e)
+                learner_busy = False
+                learner_cond.notify_all()
+
+    def pause_learner():
+        # waits until the learner is between two updates and keeps it there
+        nonlocal checkpointing
+        with learner_cond:
+            checkpointing = True
+            learner_cond.wait_for(lambda: not learner_busy)
+
+    def resume_learner():
+        nonlocal checkpointing
+        with learner_cond:
+            checkpointing = False
+            learner_cond.notify_all()
+
+    def stop_learner():
+        nonlocal learner_stopped
+        with learner_cond:
+            learner_stopped = True
+            learner_cond.notify_all()
+        learner.join()
+
+    if learner_thread:
+        learner = threading.Thread(target=run_learner, daemon=True)
+        learner.start()
+
     episode_rewards = [0.0]
+    env_rewards = np.zeros(nenvs)
     saved_mean_reward = None
     obs = env.reset()
     reset = True
+
+    def steps_reached(freq):
+        # how many multiples of freq the last nenvs steps reached
+        return t // freq - (t - nenvs) // freq
+
     with tempfile.TemporaryDirectory() as td:
+        td = checkpoint_path or td
         model_saved = False
         model_file = os.path.join(td, "model")
-        for t in range(max_timesteps):
-            if callback is not None:
-                if callback(locals(), globals()):
-                    break
-            # Take action and update exploration to the newest value
-            kwargs = {}
-            if not param_noise:
-                update_eps = exploration.value(t)
-                update_param_noise_threshold = 0.
-            else:
-                update_eps = 0.
-                # Compute the threshold such that the KL divergence between perturbed and non-perturbed
-                # policy is comparable to eps-greedy exploration with eps = exploration.value(t).
-                # See Appendix C.1 in Parameter Space Noise for Exploration, Plappert et al., 2017
-                # for detailed explanation.
-                update_param_noise_threshold = -np.log(1. - exploration.value(t) + exploration.value(t) / float(env.action_space.n))
-                kwargs['reset'] = reset
-                kwargs['update_param_noise_threshold'] = update_param_noise_threshold
-                kwargs['update_param_noise_scale'] = True
-            action = act(np.array(obs)[None], update_eps=update_eps, **kwargs)[0]
-            env_action = action
-            reset = False
-            new_obs, rew, done, _ = env.step(env_action)
-            # Store transition in the replay buffer.
-            replay_buffer.add(obs, action, rew, new_obs, float(done))
-            obs = new_obs
-
-            episode_rewards[-1] += rew
-            if done:
-                obs = env.reset()
-                episode_rewards.append(0.0)
-                reset = True
-
-            if t > learning_starts and t % train_freq == 0:
-                # Minimize the error in Bellman's equation on a batch sampled from replay buffer.
-                if prioritized_replay:
-                    experience = replay_buffer.sample(batch_size, beta=beta_schedule.value(t))
-                    (obses_t, actions, rewards, obses_tp1, dones, weights, batch_idxes) = experience
+        # saved next to the model, see ReplayBuffer.save
+        replay_buffer_dir = os.path.join(td, "replay_buffer")
+        if tf.train.latest_checkpoint(td) is not None:
+            load_state(model_file)
+            if os.path.exists(replay_buffer_dir):
+                with buffer_lock:
+                    replay_buffer.load(replay_buffer_dir)
+            logger.log('Loaded model from {}'.format(model_file))
+            model_saved = True
+            if learner_thread:
+                publish_weights()
+        try:
+            for t in range(0, max_timesteps, nenvs):
+                if callback is not None:
+                    if callback(locals(), globals()):
+                        break
+                if learner_errors:
+                    raise learner_errors[0]
+                # Take action and update exploration to the newest value
+                kwargs = {}
+                if not param_noise:
+                    update_eps = exploration.value(t)
+                    update_param_noise_threshold = 0.
+                else:
+                    update_eps = 0.
+                    # Compute the threshold such that the KL divergence between perturbed and non-perturbed
+                    # policy is comparable to eps-greedy exploration with eps = exploration.value(t).
+                    # See Appendix C.1 in Parameter Space Noise for Exploration, Plappert et al., 2017
+                    # for detailed explanation.
+                    update_param_noise_threshold = -np.log(1. - exploration.value(t) + exploration.value(t) / float(env.action_space.n))
+                    kwargs['reset'] = reset
+                    kwargs['update_param_noise_threshold'] = update_param_noise_threshold
+                    kwargs['update_param_noise_scale'] = True
+                if vectorized:
+                    with weights_lock:
+                        action = actor_act(obs, update_eps=update_eps, **kwargs)
+                    new_obs, rew, done, _ = env.step(action)
+                    # Store transitions in the replay buffer. Observations after a done are
+                    # those of the next episode, but they are masked out of the targets.
+                    with buffer_lock:
+                        replay_buffer.extend(obs, action, rew, new_obs, np.asarray(done, dtype=np.float32))
+                    obs = new_obs
                 else:
-                    obses_t, actions, rewards, obses_tp1, dones = replay_buffer.sample(batch_size)
-                    weights, batch_idxes = np.ones_like(rewards), None
-                td_errors = train(obses_t, actions, rewards, obses_tp1, dones, weights)
-                if prioritized_replay:
-                    new_priorities = np.abs(td_errors) + prioritized_replay_eps
-                    replay_buffer.update_priorities(batch_idxes, new_priorities)
-
-            if t > learning_starts and t % target_network_update_freq == 0:
-                # Update target network periodically.
-                update_target()
-
-            mean_100ep_reward = round(np.mean(episode_rewards[-101:-1]), 1)
-            num_episodes = len(episode_rewards)
-            if done and print_freq is not None and len(episode_rewards) % print_freq == 0:
-                logger.record_tabular("steps", t)
-                logger.record_tabular("episodes", num_episodes)
-                logger.record_tabular("mean 100 episode reward", mean_100ep_reward)
-                logger.record_tabular("% time spent exploring", int(100 * exploration.value(t)))
-                logger.dump_tabular()
-
-            if (checkpoint_freq is not None and t > learning_starts and
-                    num_episodes > 100 and t % checkpoint_freq == 0):
-                if saved_mean_reward is None or mean_100ep_reward > saved_mean_reward:
-                    if print_freq is not None:
-                        logger.log("Saving model due to mean reward increase: {} -> {}".format(
-                                   saved_mean_reward, mean_100ep_reward))
-                    save_state(model_file)
-                    model_saved = True
-                    saved_mean_reward = mean_100ep_reward
+                    with weights_lock:
+                        action = actor_act(np.array(obs)[None], update_eps=update_eps, **kwargs)[0]
+                    env_action = action
+                    new_obs, rew, done, _ = env.step(env_action)
+                    # Store transition in the replay buffer.
+                    with buffer_lock:
+                        replay_buffer.add(obs, action, rew, new_obs, float(done))
+                    obs = new_obs
+                    if done:
+                        obs = env.reset()
+                    rew, done = np.array([rew]), np.array([done])
+                reset = False
+
+                env_rewards += rew
+                for i in np.flatnonzero(done):
+                    episode_rewards[-1] = env_rewards[i]
+                    episode_rewards.append(0.0)
+                    env_rewards[i] = 0.0
+                if done[0]:
+                    # all envs share one perturbation of the policy, which is resampled
+                    # about once per episode length
+                    reset = True
+
+                if learner_thread:
+                    with learner_cond:
+                        env_steps = t + nenvs
+                        learner_cond.notify_all()
+                        # hold the replay ratio when training is slower than acting
+                        learner_cond.wait_for(actor_can_step)
+                elif t > learning_starts:
+                    for _ in range(steps_reached(train_freq)):
+                        train_step(t)
+
+                if not learner_thread and t > learning_starts and steps_reached(target_network_update_freq):
+                    # Update target network periodically.
+                    update_target()
+
+                mean_100ep_reward = round(np.mean(episode_rewards[-101:-1]), 1)
+                num_episodes = len(episode_rewards)
+                if (done.any() and print_freq is not None and
+                        num_episodes // print_freq != (num_episodes - done.sum()) // print_freq):
+                    logger.record_tabular("steps", t)
+                    logger.record_tabular("episodes", num_episodes)
+                    logger.record_tabular("mean 100 episode reward", mean_100ep_reward)
+                    logger.record_tabular("% time spent exploring", int(100 * exploration.value(t)))
+                    if learner_thread and t > learning_starts:
+                        logger.record_tabular("replay ratio", num_updates * batch_size / (t - learning_starts))
+                    logger.dump_tabular()
+
+                if (checkpoint_freq is not None and t > learning_starts and
+                        num_episodes > 100 and steps_reached(checkpoint_freq)):
+                    if saved_mean_reward is None or mean_100ep_reward > saved_mean_reward:
+                        if print_freq is not None:
+                            logger.log("Saving model due to mean reward increase: {} -> {}".format(
+                                       saved_mean_reward, mean_100ep_reward))
+                        if learner_thread:
+                            # so that the checkpoint does not mix weights of two updates
+                            pause_learner()
+                        try:
+                            save_state(model_file)
+                            with buffer_lock:
+                                replay_buffer.save(replay_buffer_dir)
+                        finally:
+                            if learner_thread:
+                                resume_learner()
+                        model_saved = True
+                        saved_mean_reward = mean_100ep_reward
+        finally:
+            if learner_thread:
+                stop_learner()
         if model_saved:
             if print_freq is not None:
                 logger.log("Restored model with mean reward: {}".format(saved_mean_reward))
             load_state(model_file)
+            if os.path.exists(replay_buffer_dir):
+                with buffer_lock:
+                    replay_buffer.load(replay_buffer_dir)
 
     return act
@@ -0,0 +1,331 @@
+import numpy as np
+
+from baselines.deepq.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, FrameStackReplayBuffer
+
+
+def _transition(i):
+    return (np.full((3,), i % 251, dtype=np.uint8), i, float(i), np.full((3,), (i + 1) % 251, dtype=np.uint8),
+            float(i % 7 == 0))
+
+
+def _fill(buffer, n, start=0):
+    for i in range(start, start + n):
+        buffer.add(*_transition(i))
+
+
+def _assert_same_columns(a, b):
+    arrays_a, arrays_b = a._snapshot_arrays(), b._snapshot_arrays()
+    assert arrays_a.keys() == arrays_b.keys()
+    for name in arrays_a:
+        assert np.array_equal(arrays_a[name][:len(a)], arrays_b[name][:len(b)]), name
+
+
+def test_snapshot_round_trip(tmpdir):
+    buffer = ReplayBuffer(50, preallocate=True)
+    _fill(buffer, 80)
+    buffer.save(str(tmpdir))
+
+    restored = ReplayBuffer(50, preallocate=True)
+    restored.load(str(tmpdir))
+    assert len(restored) == len(buffer)
+    assert restored._next_idx == buffer._next_idx
+    _assert_same_columns(buffer, restored)
+
+
+def test_snapshot_round_trip_list_storage(tmpdir):
+    buffer = ReplayBuffer(50)
+    _fill(buffer, 30)
+    buffer.save(str(tmpdir))
+
+    restored = ReplayBuffer(50)
+    restored.load(str(tmpdir))
+    assert len(restored) == 30
+    obs_t = restored._snapshot_arrays()['obs_t']
+    assert np.array_equal(obs_t[:30], [_transition(i)[0] for i in range(30)])
+
+
+def test_prioritized_snapshot_round_trip(tmpdir):
+    buffer = PrioritizedReplayBuffer(50, alpha=0.6, preallocate=True)
+    _fill(buffer, 40)
+    buffer.update_priorities(np.arange(0, 40, 3), np.linspace(0.1, 5., 14))
+    buffer.save(str(tmpdir))
+
+    restored = PrioritizedReplayBuffer(50, alpha=0.6, preallocate=True)
+    restored.load(str(tmpdir))
+    _assert_same_columns(buffer, restored)
+    assert np.isclose(restored._it_sum.sum(), buffer._it_sum.sum())
+    assert np.isclose(restored._it_min.min(), buffer._it_min.min())
+    assert np.allclose(restored._it_sum[np.arange(40)], buffer._it_sum[np.arange(40)])
+    assert restored._max_priority == buffer._max_priority
+
+
+def test_snapshot_resave_after_load(tmpdir):
+    # the restored arrays are memory-mapped from the files that are saved over
+    buffer = ReplayBuffer(1000, preallocate=True)
+    _fill(buffer, 1000)
+    buffer.save(str(tmpdir))
+    buffer.load(str(tmpdir))
+    _fill(buffer, 10, start=1000)
+    buffer.save(str(tmpdir))
+
+    restored = ReplayBuffer(1000, preallocate=True)
+    restored.load(str(tmpdir))
+    _assert_same_columns(buffer, restored)
+    assert restored._snapshot_arrays()['action'][0] == 1000
+
+
+def test_prioritized_snapshot_resave_after_load(tmpdir):
+    buffer = PrioritizedReplayBuffer(64, alpha=0.6, preallocate=True)
+    _fill(buffer, 64)
+    buffer.save(str(tmpdir))
+    buffer.load(str(tmpdir))
+    _fill(buffer, 5, start=64)
+    buffer.update_priorities([1, 2], [3., 4.])
+    buffer.save(str(tmpdir))
+
+    restored = PrioritizedReplayBuffer(64, alpha=0.6, preallocate=True)
+    restored.load(str(tmpdir))
+    _assert_same_columns(buffer, restored)
+    assert np.isclose(restored._it_sum.sum(), buffer._it_sum.sum())
+
+
+def test_frame_stack_snapshot_resave_after_load(tmpdir):
+    buffer = FrameStackReplayBuffer(40, frame_stack=2, num_streams=2)
+    obs = np.zeros((2, 1, 2), dtype=np.uint8)
+    for i in range(30):
+        obs_tp1 = np.concatenate([obs[..., 1:], np.full((2, 1, 1), i, np.uint8)], axis=-1)
+        buffer.extend(obs, [i, i], [0., 0.], obs_tp1, [0., 0.])
+        obs = obs_tp1
+    buffer.save(str(tmpdir))
+    buffer.load(str(tmpdir))
+    buffer.extend(obs, [30, 30], [0., 0.], obs, [1., 1.])
+    buffer.save(str(tmpdir))
+
+    restored = FrameStackReplayBuffer(40, frame_stack=2, num_streams=2)
+    restored.load(str(tmpdir))
+    for name, array in buffer._snapshot_arrays().items():
+        assert np.array_equal(array, restored._snapshot_arrays()[name]), name
+    assert np.array_equal(restored._stream_next, buffer._stream_next)
+
+
+def test_preallocated_columns():
+    buffer = ReplayBuffer(10, preallocate=True)
+    _fill(buffer, 13)
+    assert len(buffer) == 10
+    obses_t, actions, rewards, obses_tp1, dones = buffer._encode_sample(np.arange(10))
+    # the three oldest transitions were overwritten by the newest ones
+    expected = [10, 11, 12, 3, 4, 5, 6, 7, 8, 9]
+    assert np.array_equal(actions, expected)
+    assert np.array_equal(rewards, np.array(expected, dtype=np.float32))
+    assert np.array_equal(obses_t, [_transition(i)[0] for i in expected])
+    assert np.array_equal(obses_tp1, [_transition(i)[3] for i in expected])
+    assert np.array_equal(dones, [_transition(i)[4] for i in expected])
+    assert obses_t.dtype == np.uint8 and rewards.dtype == np.float32 and dones.dtype == np.float32
+
+
+def test_preallocated_sample():
+    buffer = ReplayBuffer(100, preallocate=True)
+    _fill(buffer, 20)
+    obses_t, actions, rewards, obses_tp1, dones = buffer.sample(64)
+    assert obses_t.shape == (64, 3) and actions.shape == (64,)
+    assert np.all(actions < 20)
+    assert np.array_equal(obses_t, [_transition(i)[0] for i in actions])
+    assert np.array_equal(obses_tp1, [_transition(i)[3] for i in actions])
+
+
+def _prioritized_buffer(priorities, alpha):
+    buffer = PrioritizedReplayBuffer(len(priorities), alpha=alpha, preallocate=True)
+    _fill(buffer, len(priorities))
+    buffer.update_priorities(np.arange(len(priorities)), priorities)
+    return buffer
+
+
+def test_prioritized_sampling_frequencies():
+    np.random.seed(0)
+    alpha = 0.7
+    priorities = np.array([0.1, 1., 2., 4., 0.5, 3., 1.5, 8.])
+    expected = priorities ** alpha / np.sum(priorities ** alpha)
+    buffer = _prioritized_buffer(priorities, alpha)
+    for stratified in (False, True):
+        idxes = np.concatenate([buffer.sample(64, beta=0.5, stratified=stratified)[-1] for _ in range(500)])
+        frequencies = np.bincount(idxes, minlength=len(priorities)) / len(idxes)
+        assert np.allclose(frequencies, expected, atol=0.01)
+
+
+def test_prioritized_weights():
+    np.random.seed(1)
+    alpha, beta = 0.6, 0.4
+    priorities = np.random.uniform(0.1, 5., size=20)
+    buffer = _prioritized_buffer(priorities, alpha)
+    weights, idxes = buffer.sample(32, beta=beta)[-2:]
+
+    # the per-index formula of the original implementation
+    p_min = buffer._it_min.min() / buffer._it_sum.sum()
+    max_weight = (p_min * len(buffer)) ** (-beta)
+    expected = []
+    for idx in idxes:
+        p_sample = buffer._it_sum[idx] / buffer._it_sum.sum()
+        expected.append((p_sample * len(buffer)) ** (-beta) / max_weight)
+    assert weights.dtype == np.float32
+    assert np.allclose(weights, expected)
+
+
+def test_prioritized_batched_update():
+    priorities = np.random.uniform(0.1, 5., size=16)
+    batched = _prioritized_buffer(np.ones(16), alpha=0.5)
+    batched.update_priorities(np.arange(16), priorities)
+    one_by_one = _prioritized_buffer(np.ones(16), alpha=0.5)
+    for idx, priority in enumerate(priorities):
+        one_by_one.update_priorities([idx], [priority])
+    assert np.allclose(batched._it_sum[np.arange(16)], one_by_one._it_sum[np.arange(16)])
+    assert np.isclose(batched._it_min.min(), one_by_one._it_min.min())
+    assert batched._max_priority == one_by_one._max_priority
+
+
+class _FrameStackEnv(object):
+    """Observations stacking the frame_stack newest 1x1 frames, numbered per env."""
+    def __init__(self, frame_stack, env_id=0, episode_length=5):
+        self.frame_stack = frame_stack
+        self.env_id = env_id
+        self.episode_length = episode_length
+        self.frame_id = 0
+
+    def _frame(self):
+        self.frame_id += 1
+        return np.full((1, 1, 1), (self.env_id * 97 + self.frame_id) % 256, dtype=np.uint8)
+
+    def reset(self):
+        self.t = 0
+        self.frames = [self._frame()] * self.frame_stack
+        return np.concatenate(self.frames, axis=-1)
+
+    def step(self):
+        self.t += 1
+        self.frames = self.frames[1:] + [self._frame()]
+        return np.concatenate(self.frames, axis=-1), self.t % self.episode_length == 0
+
+
+def _assert_same_as_naive(buffer, naive, batch_size=256):
+    # actions are unique transition ids, so samples can be looked up in the naive buffer
+    obses_t, actions, rewards, obses_tp1, dones = buffer.sample(batch_size)
+    naive_actions = naive._snapshot_arrays()['action'][:len(naive)]
+    rows = [np.flatnonzero(naive_actions == action) for action in actions]
+    assert all(len(row) == 1 for row in rows)
+    expected = naive._encode_sample(np.concatenate(rows))
+    for column, expected_column in zip((obses_t, actions, rewards, obses_tp1, dones), expected):
+        assert np.array_equal(column, expected_column)
+
+
+def test_frame_stack_matches_naive_buffer():
+    np.random.seed(2)
+    env = _FrameStackEnv(frame_stack=3, episode_length=7)
+    # 40 frames hold about 8 episodes of transitions, so the buffer wraps around many times
+    buffer = FrameStackReplayBuffer(40, frame_stack=3)
+    naive = ReplayBuffer(300, preallocate=True)  # keeps every transition
+    obs = env.reset()
+    for i in range(300):
+        obs_tp1, done = env.step()
+        buffer.add(obs, i, float(i), obs_tp1, float(done))
+        naive.add(obs, i, float(i), obs_tp1, float(done))
+        obs = env.reset() if done else obs_tp1
+        if i > 10 and i % 13 == 0:
+            _assert_same_as_naive(buffer, naive)
+
+
+def test_frame_stack_samples_every_stored_transition():
+    np.random.seed(3)
+    env = _FrameStackEnv(frame_stack=2, episode_length=4)
+    buffer = FrameStackReplayBuffer(30, frame_stack=2)
+    obs = env.reset()
+    for i in range(100):
+        obs_tp1, done = env.step()
+        buffer.add(obs, i, 0., obs_tp1, float(done))
+        obs = env.reset() if done else obs_tp1
+    actions = buffer.sample(2000)[1]
+    # the newest transitions whose frames are all still stored
+    valid = buffer._is_valid(np.arange(len(buffer)))
+    assert set(actions) == set(buffer._actions[np.flatnonzero(valid)])
+
+
+def _batch(start, n):
+    return [np.array(column) for column in zip(*[_transition(i) for i in range(start, start + n)])]
+
+
+def test_extend_matches_add():
+    for batch_size in (1, 3, 7, 12):
+        extended = ReplayBuffer(10, preallocate=True)
+        added = ReplayBuffer(10, preallocate=True)
+        for start in range(0, 30, batch_size):
+            extended.extend(*_batch(start, batch_size))
+            _fill(added, batch_size, start)
+        assert len(extended) == len(added)
+        assert extended._next_idx == added._next_idx
+        _assert_same_columns(extended, added)
+
+
+def test_prioritized_extend_matches_add():
+    extended = PrioritizedReplayBuffer(8, alpha=0.6, preallocate=True)
+    added = PrioritizedReplayBuffer(8, alpha=0.6, preallocate=True)
+    for start in range(0, 20, 4):
+        extended.extend(*_batch(start, 4))
+        _fill(added, 4, start)
+        for buffer in (extended, added):
+            buffer.update_priorities([start % 8], [start + 1.])
+    _assert_same_columns(extended, added)
+    assert np.allclose(extended._it_sum[np.arange(8)], added._it_sum[np.arange(8)])
+    assert np.isclose(extended._it_min.min(), added._it_min.min())
+
+
+def test_frame_stack_extend_matches_add_per_stream():
+    np.random.seed(4)
+    nenvs = 3
+    envs = [_FrameStackEnv(frame_stack=2, env_id=i, episode_length=3 + i) for i in range(nenvs)]
+    extended = FrameStackReplayBuffer(90, frame_stack=2, num_streams=nenvs)
+    # one buffer per env, added to one transition at a time
+    added = [FrameStackReplayBuffer(30, frame_stack=2) for _ in range(nenvs)]
+    obs = [env.reset() for env in envs]
+    for t in range(100):
+        steps = [env.step() for env in envs]
+        obs_tp1 = [obs_tp1 for obs_tp1, _ in steps]
+        dones = [float(done) for _, done in steps]
+        actions = [t * nenvs + i for i in range(nenvs)]
+        extended.extend(np.array(obs), actions, [0.] * nenvs, np.array(obs_tp1), dones)
+        for i in range(nenvs):
+            added[i].add(obs[i], actions[i], 0., obs_tp1[i], dones[i])
+        obs = [env.reset() if done else o for env, o, done in zip(envs, obs_tp1, dones)]
+    for i in range(nenvs):
+        segment = slice(i * 30, (i + 1) * 30)
+        for name, array in added[i]._snapshot_arrays().items():
+            assert np.array_equal(extended._snapshot_arrays()[name][segment], array), name
+    assert len(extended) == sum(len(buffer) for buffer in added)
+    # samples come from every stream and are valid
+    actions = extended.sample(500)[1]
+    assert set(actions % nenvs) == set(range(nenvs))
+
+
+def test_memory_mapped_storage(tmpdir):
+    np.random.seed(5)
+    in_memory = PrioritizedReplayBuffer(32, alpha=0.6, preallocate=True)
+    mapped = PrioritizedReplayBuffer(32, alpha=0.6, storage_dir=str(tmpdir))
+    for buffer in (in_memory, mapped):
+        _fill(buffer, 20)
+        buffer.extend(*_batch(20, 20))
+    assert isinstance(mapped._storage[0], np.memmap)
+    _assert_same_columns(in_memory, mapped)
+    idxes = np.random.randint(0, 32, size=16)
+    for column, expected in zip(mapped._encode_sample(idxes), in_memory._encode_sample(idxes)):
+        assert np.array_equal(column, expected)
+
+
+def test_memory_mapped_frame_stack(tmpdir):
+    env = _FrameStackEnv(frame_stack=2)
+    buffer = FrameStackReplayBuffer(20, frame_stack=2, storage_dir=str(tmpdir))
+    naive = ReplayBuffer(100, preallocate=True)
+    obs = env.reset()
+    for i in range(50):
+        obs_tp1, done = env.step()
+        buffer.add(obs, i, 0., obs_tp1, float(done))
+        naive.add(obs, i, 0., obs_tp1, float(done))
+        obs = env.reset() if done else obs_tp1
+    assert isinstance(buffer._frames, np.memmap)
+    _assert_same_as_naive(buffer, naive)
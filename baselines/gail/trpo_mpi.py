@@ -12,7 +12,7 @@ import tensorflow as tf
 import numpy as np
 
 import baselines.common.tf_util as U
-from baselines.common import explained_variance, zipsame, dataset, fmt_row
+from baselines.common import explained_variance, zipsame, dataset, fmt_row, gae
 from baselines import logger
 from baselines.common import colorize
 from baselines.common.mpi_adam import MpiAdam
@@ -89,16 +89,9 @@ def traj_segment_generator(pi, env, reward_giver, horizon, stochastic):
 
 
 def add_vtarg_and_adv(seg, gamma, lam):
-    new = np.append(seg["new"], 0)  # last element is only used for last vtarg, but we already zeroed it if last new = 1
-    vpred = np.append(seg["vpred"], seg["nextvpred"])
-    T = len(seg["rew"])
-    seg["adv"] = gaelam = np.empty(T, 'float32')
-    rew = seg["rew"]
-    lastgaelam = 0
-    for t in reversed(range(T)):
-        nonterminal = 1-new[t+1]
-        delta = rew[t] + gamma * vpred[t+1] * nonterminal - vpred[t]
-        gaelam[t] = lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
+    # the step after the segment is never new, nextvpred is already zeroed if the last step was terminal
+    adv, _ = gae(seg["rew"], seg["vpred"], seg["new"], seg["nextvpred"], 0, gamma, lam)
+    seg["adv"] = adv.astype('float32')
     seg["tdlamret"] = seg["adv"] + seg["vpred"]
 
 
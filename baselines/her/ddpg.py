@@ -1,3 +1,5 @@
+import queue
+import threading
 from collections import OrderedDict
 
 import numpy as np
@@ -17,11 +19,15 @@ def dims_to_shapes(input_dims):
 
 
 class DDPG(object):
+    # seconds next_batch() waits for a prefetched batch before sampling one itself
+    prefetch_timeout = 1.
+
     @store_args
     def __init__(self, input_dims, buffer_size, hidden, layers, network_class, polyak, batch_size,
                  Q_lr, pi_lr, norm_eps, norm_clip, max_u, action_l2, clip_obs, scope, T,
                  rollout_batch_size, subtract_goals, relative_goals, clip_pos_returns, clip_return,
-                 sample_transitions, gamma, reuse=False, **kwargs):
+                 sample_transitions, gamma, reuse=False, prefetch_batches=0, buffer_dir=None,
+                 **kwargs):
         """Implementation of DDPG that is used in combination with Hindsight Experience Replay (HER).
 
         Args:
@@ -50,6 +56,10 @@ class DDPG(object):
             sample_transitions (function) function that samples from the replay buffer
             gamma (float): gamma used for Q learning updates
             reuse (boolean): whether or not the networks should be reused
+            prefetch_batches (int): if > 0, a background thread keeps this many sampled and
+                preprocessed batches queued for train(); call close() to stop it
+            buffer_dir (str): if given, the replay buffer is memory-mapped from files in this
+                directory instead of being kept in memory
         """
         if self.clip_return is None:
             self.clip_return = np.inf
@@ -90,7 +100,12 @@ class DDPG(object):
         buffer_shapes['ag'] = (self.T+1, self.dimg)
 
         buffer_size = (self.buffer_size // self.rollout_batch_size) * self.rollout_batch_size
-        self.buffer = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions)
+        self.buffer = ReplayBuffer(buffer_shapes, buffer_size, self.T, self.sample_transitions,
+                                   storage_dir=self.buffer_dir)
+
+        self.prefetch_thread = None
+        if self.prefetch_batches > 0:
+            self.start_prefetch(self.prefetch_batches)
 
     def _random_action(self, n):
         return np.random.uniform(low=-self.max_u, high=self.max_u, size=(n, self.dimu))
@@ -148,8 +163,6 @@ class DDPG(object):
 
         if update_stats:
             # add transitions to normalizer
-            episode_batch['o_2'] = episode_batch['o'][:, 1:, :]
-            episode_batch['ag_2'] = episode_batch['ag'][:, 1:, :]
             num_normalizing_transitions = transitions_in_episode_batch(episode_batch)
             transitions = self.sample_transitions(episode_batch, num_normalizing_transitions)
 
@@ -194,9 +207,76 @@ class DDPG(object):
         transitions_batch = [transitions[key] for key in self.stage_shapes.keys()]
         return transitions_batch
 
+    def start_prefetch(self, num_batches):
+        """Starts a background thread that samples and preprocesses batches while the main
+        thread trains, keeping up to num_batches of them queued. Queued batches may have been
+        sampled before the latest store_episode(), i.e. they lag behind by at most num_batches.
+        """
+        assert self.prefetch_thread is None, "prefetching has already been started"
+        self.prefetch_queue = queue.Queue(maxsize=num_batches)
+        # bumped by clear_buffer(), batches of older generations are dropped
+        self.prefetch_generation = 0
+        self.prefetch_stop = threading.Event()
+        self.prefetch_thread = threading.Thread(target=self._prefetch, daemon=True)
+        self.prefetch_thread.start()
+
+    def _prefetch(self):
+        while not self.prefetch_stop.is_set():
+            if self.buffer.get_current_episode_size() == 0:
+                self.prefetch_stop.wait(0.01)
+                continue
+            generation = self.prefetch_generation
+            try:
+                batch = self.sample_batch()
+            except Exception as e:
+                # handed to train(), which re-raises it in the main thread
+                batch = e
+            while not self.prefetch_stop.is_set():
+                try:
+                    self.prefetch_queue.put((generation, batch), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def _drain_prefetch_queue(self):
+        while True:
+            try:
+                self.prefetch_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def stop_prefetch(self):
+        """Stops the prefetching thread (if any) and drops the batches it has queued.
+        """
+        if self.prefetch_thread is None:
+            return
+        self.prefetch_stop.set()
+        self.prefetch_thread.join()
+        self._drain_prefetch_queue()
+        self.prefetch_thread = None
+
+    def next_batch(self):
+        """Returns the next training batch, from the prefetching thread if it is running. If
+        none is ready within `prefetch_timeout` seconds, e.g. because the thread has died, the
+        batch is sampled in this thread instead.
+        """
+        if self.prefetch_thread is None:
+            return self.sample_batch()
+        while True:
+            try:
+                generation, batch = self.prefetch_queue.get(timeout=self.prefetch_timeout)
+            except queue.Empty:
+                return self.sample_batch()
+            if generation != self.prefetch_generation:
+                # sampled from the contents before the last clear_buffer()
+                continue
+            if isinstance(batch, Exception):
+                raise batch
+            return batch
+
     def stage_batch(self, batch=None):
         if batch is None:
-            batch = self.sample_batch()
+            batch = self.next_batch()
         assert len(self.buffer_ph_tf) == len(batch)
         self.sess.run(self.stage_op, feed_dict=dict(zip(self.buffer_ph_tf, batch)))
 
@@ -215,6 +295,28 @@ class DDPG(object):
 
     def clear_buffer(self):
         self.buffer.clear_buffer()
+        if self.prefetch_thread is not None:
+            # batches that were sampled from the old contents, including one that the
+            # thread may be sampling right now, are dropped by next_batch()
+            self.prefetch_generation += 1
+            self._drain_prefetch_queue()
+
+    def save_buffer(self, path):
+        """Saves the replay buffer to the directory path, see ReplayBuffer.save.
+        """
+        self.buffer.save(path)
+
+    def load_buffer(self, path):
+        """Replaces the replay buffer contents by a snapshot written by save_buffer().
+        """
+        self.buffer.load(path)
+        if self.prefetch_thread is not None:
+            # batches that were sampled from the old contents
+            self.prefetch_generation += 1
+            self._drain_prefetch_queue()
+
+    def close(self):
+        self.stop_prefetch()
 
     def _vars(self, scope):
         res = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=self.scope + '/' + scope)
@@ -316,7 +418,7 @@ class DDPG(object):
         """
         excluded_subnames = ['_tf', '_op', '_vars', '_adam', 'buffer', 'sess', '_stats',
                              'main', 'target', 'lock', 'env', 'sample_transitions',
-                             'stage_shapes', 'create_actor_critic']
+                             'stage_shapes', 'create_actor_critic', 'prefetch']
 
         state = {k: v for k, v in self.__dict__.items() if all([not subname in k for subname in excluded_subnames])}
         state['buffer_size'] = self.buffer_size
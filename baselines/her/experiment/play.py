@@ -54,6 +54,7 @@ def main(policy_file, seed, n_test_rollouts, render):
     for key, val in evaluator.logs('test'):
         logger.record_tabular(key, np.mean(val))
     logger.dump_tabular()
+    evaluator.close()
 
 
 if __name__ == '__main__':
@@ -30,6 +30,12 @@ def train(policy, rollout_worker, evaluator,
     latest_policy_path = os.path.join(logger.get_dir(), 'policy_latest.pkl')
     best_policy_path = os.path.join(logger.get_dir(), 'policy_best.pkl')
     periodic_policy_path = os.path.join(logger.get_dir(), 'policy_{}.pkl')
+    # every MPI worker has its own replay buffer
+    buffer_path = os.path.join(logger.get_dir(), 'buffer_{}'.format(rank))
+
+    if os.path.exists(os.path.join(buffer_path, 'state.pkl')):
+        logger.info('Restoring replay buffer from {} ...'.format(buffer_path))
+        policy.load_buffer(buffer_path)
 
     logger.info("Training...")
     best_success_rate = -1
@@ -71,6 +77,8 @@ def train(policy, rollout_worker, evaluator,
             policy_path = periodic_policy_path.format(epoch)
             logger.info('Saving periodic policy to {} ...'.format(policy_path))
             evaluator.save_policy(policy_path)
+        if policy_save_interval > 0 and epoch % policy_save_interval == 0 and save_policies:
+            policy.save_buffer(buffer_path)
 
         # make sure that different threads have different seeds
         local_uniform = np.random.uniform(size=(1,))
@@ -150,7 +158,7 @@ def launch(
         'T': params['T'],
     }
 
-    for name in ['T', 'rollout_batch_size', 'gamma', 'noise_eps', 'random_eps']:
+    for name in ['T', 'rollout_batch_size', 'gamma', 'noise_eps', 'random_eps', 'vec_env_type']:
         rollout_params[name] = params[name]
         eval_params[name] = params[name]
 
@@ -165,6 +173,9 @@ def launch(
         evaluator=evaluator, n_epochs=n_epochs, n_test_rollouts=params['n_test_rollouts'],
         n_cycles=params['n_cycles'], n_batches=params['n_batches'],
         policy_save_interval=policy_save_interval, save_policies=save_policies)
+    rollout_worker.close()
+    evaluator.close()
+    policy.close()
 
 
 @click.command()
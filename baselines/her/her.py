@@ -1,5 +1,17 @@
 import numpy as np
 
+from baselines.common import array_storage
+
+
+def gather_transitions(value, episode_idxs, t_samples):
+    """Returns value[episode_idxs, t_samples] for an array(n_episodes x T x dim_key). The rows are
+    taken through precomputed linear indices into the flattened (episode, time) axis, which is
+    cheaper than 2-d fancy indexing. `value` should be contiguous (e.g. a leading slice of a
+    buffer) so that flattening it does not copy.
+    """
+    flat = value.reshape((-1,) + value.shape[2:])
+    return array_storage.take(flat, episode_idxs * value.shape[1] + t_samples)
+
 
 def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
     """Creates a sample function that can be used for HER experience replay.
@@ -9,7 +21,10 @@ def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
             regular DDPG experience replay is used
         replay_k (int): the ratio between HER replays and regular replays (e.g. k = 4 -> 4 times
             as many HER replays as regular replays are used)
-        reward_fun (function): function to re-compute the reward with substituted goals
+        reward_fun (function): function to re-compute the reward with substituted goals; it is
+            called once per sampled batch as reward_fun(ag_2=..., g=..., info=...) with arrays of
+            batch_size rows (and a dict of such arrays for info) and must return an array of
+            batch_size rewards
     """
     if replay_strategy == 'future':
         future_p = 1 - (1. / (1 + replay_k))
@@ -18,6 +33,8 @@ def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
 
     def _sample_her_transitions(episode_batch, batch_size_in_transitions):
         """episode_batch is {key: array(buffer_size x T x dim_key)}
+        'o' and 'ag' are of size T+1; 'o_2' and 'ag_2' are gathered from them
+        for the sampled rows only, so they need not be part of episode_batch.
         """
         T = episode_batch['u'].shape[1]
         rollout_batch_size = episode_batch['u'].shape[0]
@@ -26,8 +43,10 @@ def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
         # Select which episodes and time steps to use.
         episode_idxs = np.random.randint(0, rollout_batch_size, batch_size)
         t_samples = np.random.randint(T, size=batch_size)
-        transitions = {key: episode_batch[key][episode_idxs, t_samples].copy()
-                       for key in episode_batch.keys()}
+        transitions = {key: gather_transitions(episode_batch[key], episode_idxs, t_samples)
+                       for key in episode_batch.keys() if key not in ['o_2', 'ag_2']}
+        transitions['o_2'] = gather_transitions(episode_batch['o'], episode_idxs, t_samples + 1)
+        transitions['ag_2'] = gather_transitions(episode_batch['ag'], episode_idxs, t_samples + 1)
 
         # Select future time indexes proportional with probability future_p. These
         # will be used for HER replay by substituting in future goals.
@@ -39,7 +58,7 @@ def make_sample_her_transitions(replay_strategy, replay_k, reward_fun):
         # Replace goal with achieved goal but only for the previously-selected
         # HER transitions (as defined by her_indexes). For the other transitions,
         # keep the original goal.
-        future_ag = episode_batch['ag'][episode_idxs[her_indexes], future_t]
+        future_ag = gather_transitions(episode_batch['ag'], episode_idxs[her_indexes], future_t)
         transitions['g'][her_indexes] = future_ag
 
         # Reconstruct info dictionary for reward  computation.
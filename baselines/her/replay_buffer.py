@@ -1,10 +1,13 @@
+import os
 import threading
 
 import numpy as np
 
+from baselines.common import array_storage
+
 
 class ReplayBuffer:
-    def __init__(self, buffer_shapes, size_in_transitions, T, sample_transitions):
+    def __init__(self, buffer_shapes, size_in_transitions, T, sample_transitions, storage_dir=None):
         """Creates a replay buffer.
 
         Args:
@@ -13,14 +16,17 @@ class ReplayBuffer:
             size_in_transitions (int): the size of the buffer, measured in transitions
             T (int): the time horizon for episodes
             sample_transitions (function): a function that samples from the replay buffer
+            storage_dir (str): if given, the buffers are memory-mapped files in this directory
+                instead of living in memory
         """
         self.buffer_shapes = buffer_shapes
         self.size = size_in_transitions // T
         self.T = T
         self.sample_transitions = sample_transitions
+        self.storage_dir = storage_dir
 
         # self.buffers is {key: array(size_in_episodes x T or T+1 x dim_key)}
-        self.buffers = {key: np.empty([self.size, *shape])
+        self.buffers = {key: array_storage.zeros([self.size, *shape], np.float64, storage_dir, key)
                         for key, shape in buffer_shapes.items()}
 
         # memory management
@@ -44,10 +50,10 @@ class ReplayBuffer:
             for key in self.buffers.keys():
                 buffers[key] = self.buffers[key][:self.current_size]
 
-        buffers['o_2'] = buffers['o'][:, 1:, :]
-        buffers['ag_2'] = buffers['ag'][:, 1:, :]
-
-        transitions = self.sample_transitions(buffers, batch_size)
+            # The sampler gathers 'o_2' and 'ag_2' for the sampled rows from 'o' and 'ag'.
+            # Sampling only touches batch_size rows, so it is done under the lock so that
+            # a concurrent store_episode() cannot overwrite episodes while they are read.
+            transitions = self.sample_transitions(buffers, batch_size)
 
         for key in (['r', 'o_2', 'ag_2'] + list(self.buffers.keys())):
             assert key in transitions, "key %s missing from transitions" % key
@@ -106,3 +112,29 @@ class ReplayBuffer:
         if inc == 1:
             idx = idx[0]
         return idx
+
+    def save(self, path):
+        """Saves the stored episodes to the directory path, streaming every buffer to its own
+        .npy file in chunks.
+        """
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            for key in self.buffers.keys():
+                array_storage.save(os.path.join(path, key + '.npy'), self.buffers[key][:self.current_size])
+            array_storage.save_state(os.path.join(path, 'state.pkl'), {
+                'current_size': self.current_size,
+                'n_transitions_stored': self.n_transitions_stored,
+            })
+
+    def load(self, path):
+        """Replaces the contents of the buffer by a snapshot written by save(). The snapshot is
+        memory-mapped (copy-on-write) if it fills the buffer and no storage_dir is set, and
+        copied otherwise.
+        """
+        state = array_storage.load_state(os.path.join(path, 'state.pkl'))
+        with self.lock:
+            for key in self.buffers.keys():
+                self.buffers[key] = array_storage.load(
+                    os.path.join(path, key + '.npy'), self.size, self.storage_dir, key)
+            self.current_size = state['current_size']
+            self.n_transitions_stored = state['n_transitions_stored']
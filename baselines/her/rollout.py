@@ -2,9 +2,9 @@ from collections import deque
 
 import numpy as np
 import pickle
-from mujoco_py import MujocoException
 
 from baselines.her.util import convert_episode_to_batch_major, store_args
+from baselines.her.vec_env import VEC_ENVS
 
 
 class RolloutWorker:
@@ -12,7 +12,7 @@ class RolloutWorker:
     @store_args
     def __init__(self, make_env, policy, dims, logger, T, rollout_batch_size=1,
                  exploit=False, use_target_net=False, compute_Q=False, noise_eps=0,
-                 random_eps=0, history_len=100, render=False, **kwargs):
+                 random_eps=0, history_len=100, render=False, vec_env_type=None, **kwargs):
         """Rollout worker generates experience by interacting with one or many environments.
 
         Args:
@@ -30,8 +30,11 @@ class RolloutWorker:
             random_eps (float): probability of selecting a completely random action
             history_len (int): length of history for statistics smoothing
             render (boolean): whether or not to render the rollouts
+            vec_env_type (str): how the `rollout_batch_size` environments are stepped: None steps
+                them one after another, 'threaded' on a thread pool and 'subproc' each in its own
+                subprocess
         """
-        self.envs = [make_env() for _ in range(rollout_batch_size)]
+        self.envs = VEC_ENVS[vec_env_type](make_env, rollout_batch_size)
         assert self.T > 0
 
         self.info_keys = [key.replace('info_', '') for key in dims.keys() if key.startswith('info_')]
@@ -50,96 +53,111 @@ class RolloutWorker:
         """Resets the `i`-th rollout environment, re-samples a new goal, and updates the `initial_o`
         and `g` arrays accordingly.
         """
-        obs = self.envs[i].reset()
-        self.initial_o[i] = obs['observation']
-        self.initial_ag[i] = obs['achieved_goal']
-        self.g[i] = obs['desired_goal']
+        self.reset_rollouts([i])
+
+    def reset_rollouts(self, idxs):
+        """Resets the rollout environments `idxs` (in parallel if a vectorized environment is used).
+        """
+        for i, obs in zip(idxs, self.envs.reset(idxs)):
+            self.initial_o[i] = obs['observation']
+            self.initial_ag[i] = obs['achieved_goal']
+            self.g[i] = obs['desired_goal']
 
     def reset_all_rollouts(self):
         """Resets all `rollout_batch_size` rollout workers.
         """
-        for i in range(self.rollout_batch_size):
-            self.reset_rollout(i)
-
-    def generate_rollouts(self):
-        """Performs `rollout_batch_size` rollouts in parallel for time horizon `T` with the current
-        policy acting on it accordingly.
+        self.reset_rollouts(range(self.rollout_batch_size))
+
+    def _rollout(self, idxs):
+        """Performs rollouts for time horizon `T` on the environments `idxs`, starting from
+        `initial_o` and `g`. Returns the time-major episode arrays, the time-major Q values (or
+        None if `compute_Q` is False) and a boolean mask of the rollouts that failed, either
+        because the simulation became unstable or because of NaN observations. Failed
+        environments are neither acted on nor stepped any further, and their data is undefined.
         """
-        self.reset_all_rollouts()
-
-        # compute observations
-        o = np.empty((self.rollout_batch_size, self.dims['o']), np.float32)  # observations
-        ag = np.empty((self.rollout_batch_size, self.dims['g']), np.float32)  # achieved goals
-        o[:] = self.initial_o
-        ag[:] = self.initial_ag
-
-        # generate episodes
-        obs, achieved_goals, acts, goals, successes = [], [], [], [], []
-        info_values = [np.empty((self.T, self.rollout_batch_size, self.dims['info_' + key]), np.float32) for key in self.info_keys]
-        Qs = []
+        n = len(idxs)
+        o = np.empty((self.T + 1, n, self.dims['o']), np.float32)  # observations
+        ag = np.empty((self.T + 1, n, self.dims['g']), np.float32)  # achieved goals
+        u = np.empty((self.T, n, self.dims['u']), np.float32)  # actions
+        g = np.repeat(self.g[idxs][None], self.T, axis=0)  # goals
+        success = np.zeros((self.T, n))
+        info_values = [np.empty((self.T, n, self.dims['info_' + key]), np.float32) for key in self.info_keys]
+        failed = np.zeros(n, dtype=np.bool_)
+        Qs = np.zeros((self.T, n), np.float32) if self.compute_Q else None
+        o[0] = self.initial_o[idxs]
+        ag[0] = self.initial_ag[idxs]
         for t in range(self.T):
+            active = np.flatnonzero(~failed)
+            if len(active) == 0:
+                break
             policy_output = self.policy.get_actions(
-                o, ag, self.g,
+                o[t, active], ag[t, active], g[t, active],
                 compute_Q=self.compute_Q,
                 noise_eps=self.noise_eps if not self.exploit else 0.,
                 random_eps=self.random_eps if not self.exploit else 0.,
                 use_target_net=self.use_target_net)
 
             if self.compute_Q:
-                u, Q = policy_output
-                Qs.append(Q)
+                u_t, Q = policy_output
+                Qs[t, active] = Q.reshape(-1)
             else:
-                u = policy_output
+                u_t = policy_output
+            # The non-batched case should still have a reasonable shape.
+            u[t, active] = u_t.reshape(len(active), -1)
 
-            if u.ndim == 1:
-                # The non-batched case should still have a reasonable shape.
-                u = u.reshape(1, -1)
-
-            o_new = np.empty((self.rollout_batch_size, self.dims['o']))
-            ag_new = np.empty((self.rollout_batch_size, self.dims['g']))
-            success = np.zeros(self.rollout_batch_size)
             # compute new states and observations
-            for i in range(self.rollout_batch_size):
-                try:
-                    # We fully ignore the reward here because it will have to be re-computed
-                    # for HER.
-                    curr_o_new, _, _, info = self.envs[i].step(u[i])
-                    if 'is_success' in info:
-                        success[i] = info['is_success']
-                    o_new[i] = curr_o_new['observation']
-                    ag_new[i] = curr_o_new['achieved_goal']
-                    for idx, key in enumerate(self.info_keys):
-                        info_values[idx][t, i] = info[key]
-                    if self.render:
-                        self.envs[i].render()
-                except MujocoException as e:
-                    return self.generate_rollouts()
-
-            if np.isnan(o_new).any():
+            results = self.envs.step(idxs[active], u[t, active])
+            for j, result in zip(active, results):
+                if result is None:
+                    failed[j] = True
+                    continue
+                curr_o_new, info = result
+                if 'is_success' in info:
+                    success[t, j] = info['is_success']
+                o[t + 1, j] = curr_o_new['observation']
+                ag[t + 1, j] = curr_o_new['achieved_goal']
+                for idx, key in enumerate(self.info_keys):
+                    info_values[idx][t, j] = info[key]
+            if self.render:
+                self.envs.render(idxs[active])
+
+            nan = np.isnan(o[t + 1]).any(axis=1) & ~failed
+            if nan.any():
                 self.logger.warning('NaN caught during rollout generation. Trying again...')
-                self.reset_all_rollouts()
-                return self.generate_rollouts()
-
-            obs.append(o.copy())
-            achieved_goals.append(ag.copy())
-            successes.append(success.copy())
-            acts.append(u.copy())
-            goals.append(self.g.copy())
-            o[...] = o_new
-            ag[...] = ag_new
-        obs.append(o.copy())
-        achieved_goals.append(ag.copy())
-        self.initial_o[:] = o
-
-        episode = dict(o=obs,
-                       u=acts,
-                       g=goals,
-                       ag=achieved_goals)
+                failed |= nan
+
+        episode = dict(o=o,
+                       u=u,
+                       g=g,
+                       ag=ag)
         for key, value in zip(self.info_keys, info_values):
             episode['info_{}'.format(key)] = value
+        episode['success'] = success
+        return episode, Qs, failed
+
+    def generate_rollouts(self):
+        """Performs `rollout_batch_size` rollouts in parallel for time horizon `T` with the current
+        policy acting on it accordingly. Rollouts that fail are retried individually on freshly
+        reset environments.
+        """
+        self.reset_all_rollouts()
+
+        episode, Qs, failed = self._rollout(np.arange(self.rollout_batch_size))
+        while failed.any():
+            retry = np.flatnonzero(failed)
+            self.reset_rollouts(retry)
+            retry_episode, retry_Qs, retry_failed = self._rollout(retry)
+            done = ~retry_failed
+            for key, value in retry_episode.items():
+                episode[key][:, retry[done]] = value[:, done]
+            if self.compute_Q:
+                # the Qs of the failed attempts are replaced, not added to
+                Qs[:, retry[done]] = retry_Qs[:, done]
+            failed[retry[done]] = False
+        self.initial_o[:] = episode['o'][-1]
 
         # stats
-        successful = np.array(successes)[-1, :]
+        successful = episode.pop('success')[-1, :]
         assert successful.shape == (self.rollout_batch_size,)
         success_rate = np.mean(successful)
         self.success_history.append(success_rate)
@@ -181,8 +199,12 @@ class RolloutWorker:
         else:
             return logs
 
+    def close(self):
+        """Closes the environments, shutting down their subprocesses or thread pool if any.
+        """
+        self.envs.close()
+
     def seed(self, seed):
         """Seeds each environment with a distinct seed derived from the passed in global seed.
         """
-        for idx, env in enumerate(self.envs):
-            env.seed(seed + 1000 * idx)
+        self.envs.seed([seed + 1000 * idx for idx in range(self.rollout_batch_size)])
@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Pipe
+
+from mujoco_py import MujocoException
+
+from baselines.common.vec_env import CloudpickleWrapper
+
+
+def step_env(env, action):
+    """Steps a single environment. Returns (obs, info), or None if the simulation became
+    unstable. The reward is dropped because it will have to be re-computed for HER.
+    """
+    try:
+        obs, _, _, info = env.step(action)
+    except MujocoException:
+        return None
+    return obs, info
+
+
+class SerialEnvs:
+    def __init__(self, make_env, n):
+        """A batch of environments that are stepped one after another in this process.
+        Unlike baselines.common.vec_env, environments are never reset automatically,
+        observations are returned as they are (e.g. dicts) and any subset of
+        environments can be reset or stepped.
+
+        Args:
+            make_env (function): a factory function that creates a new instance of the environment
+            n (int): the number of environments
+        """
+        self.envs = [make_env() for _ in range(n)]
+
+    def reset(self, idxs):
+        """Resets the environments `idxs` and returns their observations.
+        """
+        return [self.envs[i].reset() for i in idxs]
+
+    def step(self, idxs, actions):
+        """Steps the environments `idxs` with `actions` and returns a list with
+        the result of `step_env` for each of them.
+        """
+        return [step_env(self.envs[i], u) for i, u in zip(idxs, actions)]
+
+    def render(self, idxs):
+        for i in idxs:
+            self.envs[i].render()
+
+    def seed(self, seeds):
+        for env, seed in zip(self.envs, seeds):
+            env.seed(seed)
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+
+class ThreadedEnvs(SerialEnvs):
+    def __init__(self, make_env, n):
+        """Like SerialEnvs, but the environments are stepped concurrently on a thread pool. Only
+        useful for simulators that release the GIL while stepping, like mujoco_py.
+        """
+        super().__init__(make_env, n)
+        self.pool = ThreadPoolExecutor(max_workers=n)
+
+    def reset(self, idxs):
+        return list(self.pool.map(lambda i: self.envs[i].reset(), idxs))
+
+    def step(self, idxs, actions):
+        return list(self.pool.map(lambda i, u: step_env(self.envs[i], u), idxs, actions))
+
+    def close(self):
+        super().close()
+        self.pool.shutdown()
+
+
+def worker(remote, parent_remote, env_fn_wrapper):
+    parent_remote.close()
+    env = env_fn_wrapper.x()
+    while True:
+        cmd, data = remote.recv()
+        if cmd == 'step':
+            remote.send(step_env(env, data))
+        elif cmd == 'reset':
+            remote.send(env.reset())
+        elif cmd == 'render':
+            remote.send(env.render())
+        elif cmd == 'seed':
+            remote.send(env.seed(data))
+        elif cmd == 'close':
+            env.close()
+            remote.close()
+            break
+        else:
+            raise NotImplementedError
+
+
+class SubprocEnvs:
+    def __init__(self, make_env, n):
+        """Like SerialEnvs, but every environment lives in its own subprocess.
+        """
+        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(n)])
+        self.ps = [Process(target=worker, args=(work_remote, remote, CloudpickleWrapper(make_env)))
+                   for (work_remote, remote) in zip(self.work_remotes, self.remotes)]
+        for p in self.ps:
+            p.daemon = True  # if the main process crashes, we should not cause things to hang
+            p.start()
+        for remote in self.work_remotes:
+            remote.close()
+
+    def _call(self, cmd, idxs, data=None):
+        if data is None:
+            data = [None] * len(idxs)
+        for i, d in zip(idxs, data):
+            self.remotes[i].send((cmd, d))
+        return [self.remotes[i].recv() for i in idxs]
+
+    def reset(self, idxs):
+        return self._call('reset', idxs)
+
+    def step(self, idxs, actions):
+        return self._call('step', idxs, actions)
+
+    def render(self, idxs):
+        self._call('render', idxs)
+
+    def seed(self, seeds):
+        self._call('seed', range(len(self.remotes)), seeds)
+
+    def close(self):
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.ps:
+            p.join()
+
+
+VEC_ENVS = {
+    None: SerialEnvs,
+    'threaded': ThreadedEnvs,
+    'subproc': SubprocEnvs,
+}
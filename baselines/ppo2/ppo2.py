@@ -6,21 +6,63 @@ import os.path as osp
 import tensorflow as tf
 from baselines import logger
 from collections import deque
-from baselines.common import explained_variance
+from concurrent.futures import ThreadPoolExecutor
+from baselines.common import explained_variance, gae
+from baselines.common.rollout_storage import RolloutStorage
 
 class Model(object):
     def __init__(self, *, policy, ob_space, ac_space, nbatch_act, nbatch_train,
-                nsteps, ent_coef, vf_coef, max_grad_norm):
+                nsteps, ent_coef, vf_coef, max_grad_norm, separate_actor=False, nbatch=None):
+        """
+        separate_actor: if True, step and value use a copy of the parameters
+            that is only updated by sync_actor(), so that rollouts can be
+            collected while train() updates the parameters
+        nbatch: if given, the batch of an update (of nbatch samples) is kept
+            in variables: it is uploaded once by load_batch(), shuffle()
+            draws a permutation in-graph and train_minibatch() trains on the
+            minibatch at an offset into it. Needs a nonrecurrent policy.
+        """
         sess = tf.get_default_session()
 
         act_model = policy(sess, ob_space, ac_space, nbatch_act, 1, reuse=False)
-        train_model = policy(sess, ob_space, ac_space, nbatch_train, nsteps, reuse=True)
 
-        A = train_model.pdtype.sample_placeholder([None])
-        ADV = tf.placeholder(tf.float32, [None])
-        R = tf.placeholder(tf.float32, [None])
-        OLDNEGLOGPAC = tf.placeholder(tf.float32, [None])
-        OLDVPRED = tf.placeholder(tf.float32, [None])
+        if nbatch is None:
+            train_model = policy(sess, ob_space, ac_space, nbatch_train, nsteps, reuse=True)
+
+            A = train_model.pdtype.sample_placeholder([None])
+            ADV = tf.placeholder(tf.float32, [None])
+            R = tf.placeholder(tf.float32, [None])
+            OLDNEGLOGPAC = tf.placeholder(tf.float32, [None])
+            OLDVPRED = tf.placeholder(tf.float32, [None])
+        else:
+            assert act_model.initial_state is None, "an in-graph batch needs a nonrecurrent policy"
+            batch_phs = {
+                'obs': tf.placeholder(act_model.X.dtype, (nbatch,) + tuple(act_model.X.shape.as_list()[1:])),
+                'returns': tf.placeholder(tf.float32, [nbatch]),
+                'actions': act_model.pdtype.sample_placeholder([nbatch]),
+                'values': tf.placeholder(tf.float32, [nbatch]),
+                'neglogpacs': tf.placeholder(tf.float32, [nbatch]),
+            }
+            with tf.variable_scope('batch'):
+                batch_vars = {name: tf.get_variable(name, ph.shape, ph.dtype, tf.zeros_initializer(), trainable=False)
+                    for name, ph in batch_phs.items()}
+                perm = tf.get_variable('perm', [nbatch], tf.int32, tf.zeros_initializer(), trainable=False)
+            _load_batch = tf.group(*[batch_vars[name].assign(ph) for name, ph in batch_phs.items()])
+            _shuffle = perm.assign(tf.random_shuffle(tf.range(nbatch)))
+            OFFSET = tf.placeholder(tf.int32, [])
+            mbinds = tf.slice(perm, [OFFSET], [nbatch_train])
+            mb = {name: tf.gather(var, mbinds) for name, var in batch_vars.items()}
+
+            train_model = policy(sess, ob_space, ac_space, nbatch_train, nsteps, reuse=True, X=mb['obs'])
+
+            A = mb['actions']
+            R = mb['returns']
+            OLDNEGLOGPAC = mb['neglogpacs']
+            OLDVPRED = mb['values']
+            # normalized per minibatch, like in train()
+            advs = R - OLDVPRED
+            advmean, advvar = tf.nn.moments(advs, axes=[0])
+            ADV = (advs - advmean) / (tf.sqrt(advvar) + 1e-8)
         LR = tf.placeholder(tf.float32, [])
         CLIPRANGE = tf.placeholder(tf.float32, [])
 
@@ -60,6 +102,19 @@ class Model(object):
                 [pg_loss, vf_loss, entropy, approxkl, clipfrac, _train],
                 td_map
             )[:-1]
+
+        def load_batch(obs, returns, actions, values, neglogpacs):
+            sess.run(_load_batch, {batch_phs['obs']:obs, batch_phs['returns']:returns, batch_phs['actions']:actions,
+                batch_phs['values']:values, batch_phs['neglogpacs']:neglogpacs})
+
+        def shuffle():
+            sess.run(_shuffle)
+
+        def train_minibatch(lr, cliprange, offset):
+            return sess.run(
+                [pg_loss, vf_loss, entropy, approxkl, clipfrac, _train],
+                {LR:lr, CLIPRANGE:cliprange, OFFSET:offset}
+            )[:-1]
         self.loss_names = ['policy_loss', 'value_loss', 'policy_entropy', 'approxkl', 'clipfrac']
 
         def save(save_path):
@@ -72,9 +127,26 @@ class Model(object):
             for p, loaded_p in zip(params, loaded_params):
                 restores.append(p.assign(loaded_p))
             sess.run(restores)
+            sync_actor()
             # If you want to load weights, also save/load observation scaling inside VecNormalize
 
+        if separate_actor:
+            # built after the optimizer, so that its variables are not in params
+            with tf.variable_scope('actor'):
+                act_model = policy(sess, ob_space, ac_space, nbatch_act, 1, reuse=False)
+            actor_params = {v.name: v for v in tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='actor/')}
+            _sync_actor = tf.group(*[actor_params['actor/' + p.name].assign(p) for p in params])
+
+        def sync_actor():
+            """Copy the trained parameters to the actor, if it is separate."""
+            if separate_actor:
+                sess.run(_sync_actor)
+
         self.train = train
+        if nbatch is not None:
+            self.load_batch = load_batch
+            self.shuffle = shuffle
+            self.train_minibatch = train_minibatch
         self.train_model = train_model
         self.act_model = act_model
         self.step = act_model.step
@@ -82,11 +154,17 @@ class Model(object):
         self.initial_state = act_model.initial_state
         self.save = save
         self.load = load
+        self.sync_actor = sync_actor
         tf.global_variables_initializer().run(session=sess) #pylint: disable=E1101
+        sync_actor()
 
 class Runner(object):
 
-    def __init__(self, *, env, model, nsteps, gamma, lam):
+    def __init__(self, *, env, model, nsteps, gamma, lam, nstorages=1):
+        """
+        nstorages: number of rollout storages used in turn, the batch
+            returned by run() stays valid for nstorages - 1 further calls
+        """
         self.env = env
         self.model = model
         nenv = env.num_envs
@@ -97,54 +175,33 @@ class Runner(object):
         self.nsteps = nsteps
         self.states = model.initial_state
         self.dones = [False for _ in range(nenv)]
+        # written in place every rollout, the returned batches are views of them
+        self.storages = [RolloutStorage(nenv, nsteps, dtypes={'obs': self.obs.dtype, 'rewards': np.float32,
+            'values': np.float32, 'neglogpacs': np.float32, 'dones': np.bool_}) for _ in range(nstorages)]
+        self.nruns = 0
 
     def run(self):
-        mb_obs, mb_rewards, mb_actions, mb_values, mb_dones, mb_neglogpacs = [],[],[],[],[],[]
+        storage = self.storages[self.nruns % len(self.storages)]
+        self.nruns += 1
         mb_states = self.states
         epinfos = []
-        for _ in range(self.nsteps):
+        for t in range(self.nsteps):
             actions, values, self.states, neglogpacs = self.model.step(self.obs, self.states, self.dones)
-            mb_obs.append(self.obs.copy())
-            mb_actions.append(actions)
-            mb_values.append(values)
-            mb_neglogpacs.append(neglogpacs)
-            mb_dones.append(self.dones)
+            storage.store(t, obs=self.obs, actions=actions, values=values, neglogpacs=neglogpacs, dones=self.dones)
             self.obs[:], rewards, self.dones, infos = self.env.step(actions)
             for info in infos:
                 maybeepinfo = info.get('episode')
                 if maybeepinfo: epinfos.append(maybeepinfo)
-            mb_rewards.append(rewards)
-        #batch of steps to batch of rollouts
-        mb_obs = np.asarray(mb_obs, dtype=self.obs.dtype)
-        mb_rewards = np.asarray(mb_rewards, dtype=np.float32)
-        mb_actions = np.asarray(mb_actions)
-        mb_values = np.asarray(mb_values, dtype=np.float32)
-        mb_neglogpacs = np.asarray(mb_neglogpacs, dtype=np.float32)
-        mb_dones = np.asarray(mb_dones, dtype=np.bool)
+            storage.store(t, rewards=rewards)
         last_values = self.model.value(self.obs, self.states, self.dones)
-        #discount/bootstrap off value fn
-        mb_returns = np.zeros_like(mb_rewards)
-        mb_advs = np.zeros_like(mb_rewards)
-        lastgaelam = 0
-        for t in reversed(range(self.nsteps)):
-            if t == self.nsteps - 1:
-                nextnonterminal = 1.0 - self.dones
-                nextvalues = last_values
-            else:
-                nextnonterminal = 1.0 - mb_dones[t+1]
-                nextvalues = mb_values[t+1]
-            delta = mb_rewards[t] + self.gamma * nextvalues * nextnonterminal - mb_values[t]
-            mb_advs[t] = lastgaelam = delta + self.gamma * self.lam * nextnonterminal * lastgaelam
-        mb_returns = mb_advs + mb_values
-        return (*map(sf01, (mb_obs, mb_returns, mb_dones, mb_actions, mb_values, mb_neglogpacs)),
-            mb_states, epinfos)
+        #discount/bootstrap off value fn, over the [nsteps, nenv] transposes of the [nenv, nsteps] storage
+        mb_advs, mb_returns = gae(storage['rewards'].T, storage['values'].T, storage['dones'].T,
+            last_values, self.dones, self.gamma, self.lam)
+        #batch of rollouts, ordered by env
+        mb_returns = mb_returns.T.reshape(-1)
+        return (storage.flat('obs'), mb_returns, storage.flat('dones'), storage.flat('actions'),
+            storage.flat('values'), storage.flat('neglogpacs'), mb_states, epinfos)
 # obs, returns, masks, actions, values, neglogpacs, states = runner.run()
-def sf01(arr):
-    """
-    swap and then flatten axes 0 and 1
-    """
-    s = arr.shape
-    return arr.swapaxes(0, 1).reshape(s[0] * s[1], *s[2:])
 
 def constfn(val):
     def f(_):
@@ -154,7 +211,13 @@ def constfn(val):
 def learn(*, policy, env, nsteps, total_timesteps, ent_coef, lr,
             vf_coef=0.5,  max_grad_norm=0.5, gamma=0.99, lam=0.95,
             log_interval=10, nminibatches=4, noptepochs=4, cliprange=0.2,
-            save_interval=0):
+            save_interval=0, pipelined=False, batch_in_graph=False):
+    # pipelined: collect the batch of the next update on a background thread
+    # while the current one is trained on. The next batch is then collected
+    # with the parameters from before the current update, one update stale,
+    # which is reported as policy_staleness.
+    # batch_in_graph: upload the batch of an update to the session once and
+    # draw the minibatches from it in-graph, instead of feeding each one.
 
     if isinstance(lr, float): lr = constfn(lr)
     else: assert callable(lr)
@@ -170,18 +233,24 @@ def learn(*, policy, env, nsteps, total_timesteps, ent_coef, lr,
 
     make_model = lambda : Model(policy=policy, ob_space=ob_space, ac_space=ac_space, nbatch_act=nenvs, nbatch_train=nbatch_train,
                     nsteps=nsteps, ent_coef=ent_coef, vf_coef=vf_coef,
-                    max_grad_norm=max_grad_norm)
+                    max_grad_norm=max_grad_norm, separate_actor=pipelined,
+                    nbatch=nbatch if batch_in_graph else None)
     if save_interval and logger.get_dir():
         import cloudpickle
         with open(osp.join(logger.get_dir(), 'make_model.pkl'), 'wb') as fh:
             fh.write(cloudpickle.dumps(make_model))
     model = make_model()
-    runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam)
+    # a pipelined runner writes the next batch while the current one is used
+    runner = Runner(env=env, model=model, nsteps=nsteps, gamma=gamma, lam=lam, nstorages=2 if pipelined else 1)
 
     epinfobuf = deque(maxlen=100)
     tfirststart = time.time()
 
     nupdates = total_timesteps//nbatch
+    if pipelined:
+        collector = ThreadPoolExecutor(max_workers=1)
+        next_rollout = collector.submit(runner.run)
+        rollout_update = 0 # number of updates before the parameters next_rollout is collected with
     for update in range(1, nupdates+1):
         assert nbatch % nminibatches == 0
         nbatch_train = nbatch // nminibatches
@@ -189,10 +258,25 @@ def learn(*, policy, env, nsteps, total_timesteps, ent_coef, lr,
         frac = 1.0 - (update - 1.0) / nupdates
         lrnow = lr(frac)
         cliprangenow = cliprange(frac)
-        obs, returns, masks, actions, values, neglogpacs, states, epinfos = runner.run() #pylint: disable=E0632
+        if pipelined:
+            obs, returns, masks, actions, values, neglogpacs, states, epinfos = next_rollout.result() #pylint: disable=E0632
+            staleness = update - 1 - rollout_update
+            model.sync_actor()
+            rollout_update = update - 1
+            if update < nupdates:
+                next_rollout = collector.submit(runner.run)
+        else:
+            obs, returns, masks, actions, values, neglogpacs, states, epinfos = runner.run() #pylint: disable=E0632
+            staleness = 0
         epinfobuf.extend(epinfos)
         mblossvals = []
-        if states is None: # nonrecurrent version
+        if states is None and batch_in_graph:
+            model.load_batch(obs, returns, actions, values, neglogpacs)
+            for _ in range(noptepochs):
+                model.shuffle()
+                for start in range(0, nbatch, nbatch_train):
+                    mblossvals.append(model.train_minibatch(lrnow, cliprangenow, start))
+        elif states is None: # nonrecurrent version
             inds = np.arange(nbatch)
             for _ in range(noptepochs):
                 np.random.shuffle(inds)
@@ -227,6 +311,7 @@ def learn(*, policy, env, nsteps, total_timesteps, ent_coef, lr,
             logger.logkv("total_timesteps", update*nbatch)
             logger.logkv("fps", fps)
             logger.logkv("explained_variance", float(ev))
+            logger.logkv("policy_staleness", staleness)
             logger.logkv('eprewmean', safemean([epinfo['r'] for epinfo in epinfobuf]))
             logger.logkv('eplenmean', safemean([epinfo['l'] for epinfo in epinfobuf]))
             logger.logkv('time_elapsed', tnow - tfirststart)
@@ -239,6 +324,8 @@ def learn(*, policy, env, nsteps, total_timesteps, ent_coef, lr,
             savepath = osp.join(checkdir, '%.5i'%update)
             print('Saving to', savepath)
             model.save(savepath)
+    if pipelined:
+        collector.shutdown()
     env.close()
 
 def safemean(xs):
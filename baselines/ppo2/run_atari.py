@@ -9,7 +9,7 @@ import multiprocessing
 import tensorflow as tf
 
 
-def train(env_id, num_timesteps, seed, policy):
+def train(env_id, num_timesteps, seed, policy, pipelined=False, batch_in_graph=False):
 
     ncpu = multiprocessing.cpu_count()
     if sys.platform == 'darwin': ncpu //= 2
@@ -26,15 +26,18 @@ def train(env_id, num_timesteps, seed, policy):
         ent_coef=.01,
         lr=lambda f : f * 2.5e-4,
         cliprange=lambda f : f * 0.1,
-        total_timesteps=int(num_timesteps * 1.1))
+        total_timesteps=int(num_timesteps * 1.1),
+        pipelined=pipelined, batch_in_graph=batch_in_graph)
 
 def main():
     parser = atari_arg_parser()
     parser.add_argument('--policy', help='Policy architecture', choices=['cnn', 'lstm', 'lnlstm'], default='cnn')
+    parser.add_argument('--pipelined', help='Collect the next batch while training on the current one', action='store_true')
+    parser.add_argument('--batch-in-graph', help='Upload each batch once and draw minibatches in-graph', action='store_true')
     args = parser.parse_args()
     logger.configure()
     train(args.env, num_timesteps=args.num_timesteps, seed=args.seed,
-        policy=args.policy)
+        policy=args.policy, pipelined=args.pipelined, batch_in_graph=args.batch_in_graph)
 
 if __name__ == '__main__':
     main()